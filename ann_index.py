@@ -0,0 +1,370 @@
+import heapq
+import math
+import random
+
+import numpy as np
+
+from vector_index import normalize
+
+# Settings and entry point of an index, copied whole by every snapshot
+SCALAR_FIELDS = ("m", "m0", "ef_construction", "ef_search", "level_mult", "entry", "max_level")
+
+
+class HNSWIndex:
+    """
+    Approximate cosine search with a Hierarchical Navigable Small World graph.
+
+    Has the same interface as `vector_index.EmbeddingMatrix`, so either can sit behind retrieval.
+    Inserts link the new node into every layer up to a randomly drawn level. Deletes unlink the
+    node and reconnect its neighbours among themselves so the graph stays navigable, then reuse
+    the slot. `ef_search` is the recall/latency knob: the size of the candidate list kept while
+    walking the bottom layer. Higher is slower and closer to exact search.
+
+    `snapshot` copies only the nodes changed since the previous snapshot, and `merge_snapshot`
+    folds such a copy into a full state that can be pickled and loaded with `from_snapshot`.
+    """
+
+    def __init__(self, m: int = 16, ef_construction: int = 128, ef_search: int = 64, seed: int = 0):
+        self.m = m
+        self.m0 = 2 * m  # The bottom layer is denser
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.level_mult = 1 / math.log(m)
+        self.random = random.Random(seed)
+        self.clear()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, key):
+        return key in self.nodes
+
+    def clear(self):
+        self.nodes = {}  # key -> node
+        self.keys = []  # node -> key, None for free slots
+        self.free = []
+        self.entry = None
+        self.max_level = -1
+        self._vectors = None
+        self._levels = np.empty(0, dtype=np.int8)
+        self._links0 = np.empty((0, self.m0), dtype=np.int32)
+        self._counts0 = np.empty(0, dtype=np.int32)
+        self._upper = []  # One {node: np.ndarray of neighbours} dict per layer above the bottom one
+        self.changed = None  # Nodes changed since the last snapshot, None when the next one has to copy everything
+
+    def add(self, key, embedding):
+        """
+        Adds or replaces the embedding stored under `key`.
+        """
+        if key in self.nodes:
+            self.remove(key)
+        vector = normalize(embedding)
+        level = min(int(-math.log(1.0 - self.random.random()) * self.level_mult), 16)
+        node = self._allocate(key, vector, level)
+
+        if self.entry is None:
+            self.entry = node
+            self.max_level = level
+            return
+
+        # Greedy descent through the layers above the new node's level
+        entry = self.entry
+        for layer in range(self.max_level, level, -1):
+            entry = self._search_layer(vector, [entry], 1, layer)[0][1]
+
+        entries = [entry]
+        for layer in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(vector, entries, self.ef_construction, layer)
+            found = [(sim, n) for sim, n in found if n != node]  # A reused slot can still be linked to
+            max_links = self.m0 if layer == 0 else self.m
+            neighbours = self._select(found, self.m)
+            self._set_links(node, layer, neighbours)
+            for neighbour in neighbours:
+                self._connect(neighbour, node, layer, max_links)
+            entries = [n for _, n in found]
+
+        if level > self.max_level:
+            self.entry = node
+            self.max_level = level
+
+    def extend(self, keys, embeddings):
+        """
+        Adds many embeddings at once.
+        """
+        for key, embedding in zip(keys, embeddings):
+            self.add(key, embedding)
+
+    def remove(self, key):
+        """
+        Removes the embedding stored under `key`, if any, and repairs the graph around it.
+        """
+        node = self.nodes.pop(key, None)
+        if node is None:
+            return
+
+        for layer in range(self._levels[node], -1, -1):
+            neighbours = self._links(node, layer)
+            max_links = self.m0 if layer == 0 else self.m
+            for neighbour in neighbours:
+                # Reconnect each neighbour with the best of its remaining links and the removed node's links
+                candidates = set(self._links(neighbour, layer).tolist()) | set(neighbours.tolist())
+                candidates = {c for c in candidates if c != neighbour and self.keys[c] is not None}
+                candidates.discard(node)
+                candidates = np.fromiter(candidates, dtype=np.int32, count=len(candidates))
+                sims = self._vectors[candidates] @ self._vectors[neighbour]
+                scored = sorted(zip(sims.tolist(), candidates.tolist()), reverse=True)
+                self._set_links(neighbour, layer, self._select(scored, max_links))
+            if layer > 0:
+                del self._upper[layer - 1][node]
+        self.keys[node] = None
+        self._counts0[node] = 0
+        self.free.append(node)
+        self._mark(node)
+
+        if node == self.entry:
+            self._pick_entry()
+
+    def search(self, query_embedding, k: int, ef: int = None):
+        """
+        Finds approximately the k stored embeddings most similar to the query.
+
+        Args:
+            query_embedding: The query vector.
+            k (int): The number of results to return.
+            ef (int): Overrides `ef_search` for this query.
+        Returns:
+            list: (key, score) pairs, most similar first.
+        """
+        if self.entry is None or k <= 0:
+            return []
+        vector = normalize(query_embedding)
+        entry = self.entry
+        for layer in range(self.max_level, 0, -1):
+            entry = self._search_layer(vector, [entry], 1, layer)[0][1]
+        found = self._search_layer(vector, [entry], max(ef or self.ef_search, k), 0)
+        return [(self.keys[node], sim) for sim, node in found[:k]]
+
+    def snapshot(self):
+        """
+        Returns a copy of what changed since the previous snapshot, which can be pickled or merged
+        with `merge_snapshot` while the original keeps changing. The first snapshot after the index
+        was built or cleared is a full state, later ones only hold the nodes that changed.
+        """
+        if self.changed is None:
+            state = dict(self.__dict__)
+            size = len(self.keys)
+            state["nodes"] = dict(self.nodes)
+            state["keys"] = list(self.keys)
+            state["free"] = list(self.free)
+            state["random"] = None
+            state["changed"] = None
+            state["_vectors"] = None if self._vectors is None else self._vectors[:size].copy()
+            state["_levels"] = self._levels[:size].copy()
+            state["_links0"] = self._links0[:size].copy()
+            state["_counts0"] = self._counts0[:size].copy()
+            state["_upper"] = [dict(layer) for layer in self._upper]
+        else:
+            nodes = sorted(self.changed)
+            state = {name: getattr(self, name) for name in SCALAR_FIELDS}
+            state.update({
+                "partial": True,
+                "size": len(self.keys),
+                "dim": self._vectors.shape[1] if self._vectors is not None else 0,
+                "free": list(self.free),
+                "changed_nodes": nodes,
+                "changed_keys": [self.keys[node] for node in nodes],
+                "_vectors": self._vectors[nodes].copy() if self._vectors is not None else None,
+                "_levels": self._levels[nodes].copy(),
+                "_links0": self._links0[nodes].copy(),
+                "_counts0": self._counts0[nodes].copy(),
+                # Link arrays above the bottom layer are replaced rather than written to, so they can be shared
+                "_upper": [{node: layer[node] for node in nodes if node in layer} for layer in self._upper],
+            })
+        self.changed = set()
+        return state
+
+    @staticmethod
+    def merge_snapshot(saved: dict, changes: dict):
+        """
+        Folds a snapshot into the full state of the previous ones.
+
+        Args:
+            saved (dict): The full state the previous snapshots add up to, updated in place. None before the first one.
+            changes (dict): What `snapshot` returned.
+        Returns:
+            dict: The full state, ready for `from_snapshot`.
+        """
+        if not changes.get("partial"):
+            return changes
+        nodes, size = changes["changed_nodes"], changes["size"]
+        state = saved
+        state.update({name: changes[name] for name in SCALAR_FIELDS})
+        state["free"] = changes["free"]
+        # Slots are reused and never given back, so the arrays only ever grow
+        grown = size - len(state["keys"])
+        if grown > 0:
+            state["keys"].extend([None] * grown)
+            if state["_vectors"] is None:
+                state["_vectors"] = np.empty((0, changes["dim"]), dtype=np.float32)
+            for name, fill in (("_vectors", 0), ("_levels", 0), ("_links0", -1), ("_counts0", 0)):
+                old = state[name]
+                state[name] = np.concatenate([old, np.full((grown, *old.shape[1:]), fill, dtype=old.dtype)])
+        for node in nodes:
+            key = state["keys"][node]
+            if key is not None and state["nodes"].get(key) == node:
+                del state["nodes"][key]
+        for node, key in zip(nodes, changes["changed_keys"]):
+            state["keys"][node] = key
+            if key is not None:
+                state["nodes"][key] = node
+        if nodes:
+            for name in ("_vectors", "_levels", "_links0", "_counts0"):
+                state[name][nodes] = changes[name]
+        while len(state["_upper"]) < len(changes["_upper"]):
+            state["_upper"].append({})
+        for layer, changed_layer in zip(state["_upper"], changes["_upper"]):
+            for node in nodes:
+                layer.pop(node, None)
+            layer.update(changed_layer)
+        return state
+
+    @classmethod
+    def from_snapshot(cls, state: dict):
+        """
+        Builds an index from a full state. The state is copied rather than taken over, so it can
+        stay the base that later snapshots are merged into.
+        """
+        index = cls.__new__(cls)
+        index.__dict__.update(state)
+        index.nodes = dict(state["nodes"])
+        index.keys = list(state["keys"])
+        index.free = list(state["free"])
+        index._upper = [dict(layer) for layer in state["_upper"]]
+        for name in ("_vectors", "_levels", "_links0", "_counts0"):
+            if state[name] is not None:
+                setattr(index, name, state[name].copy())
+        index.random = random.Random(len(index.keys))
+        index.changed = set()
+        return index
+
+    def _allocate(self, key, vector, level):
+        if self.free:
+            node = self.free.pop()
+            self.keys[node] = key
+        else:
+            node = len(self.keys)
+            self.keys.append(key)
+            self._reserve(node + 1, vector.shape[0])
+        self.nodes[key] = node
+        self._mark(node)
+        self._vectors[node] = vector
+        self._levels[node] = level
+        self._counts0[node] = 0
+        while len(self._upper) < level:
+            self._upper.append({})
+        for layer in range(1, level + 1):
+            self._upper[layer - 1][node] = np.empty(0, dtype=np.int32)
+        return node
+
+    def _reserve(self, size, dim):
+        if self._vectors is None:
+            self._vectors = np.empty((0, dim), dtype=np.float32)
+        if size <= len(self._vectors):
+            return
+        capacity = max(size, 2 * len(self._vectors), 64)
+        vectors = np.empty((capacity, dim), dtype=np.float32)
+        vectors[:len(self._vectors)] = self._vectors
+        levels = np.zeros(capacity, dtype=np.int8)
+        levels[:len(self._levels)] = self._levels
+        links0 = np.full((capacity, self.m0), -1, dtype=np.int32)
+        links0[:len(self._links0)] = self._links0
+        counts0 = np.zeros(capacity, dtype=np.int32)
+        counts0[:len(self._counts0)] = self._counts0
+        self._vectors, self._levels, self._links0, self._counts0 = vectors, levels, links0, counts0
+
+    def _links(self, node, layer):
+        if layer == 0:
+            return self._links0[node, :self._counts0[node]]
+        # Links are not symmetric, so a link can outlive the node it points to on upper layers
+        return self._upper[layer - 1].get(node, np.empty(0, dtype=np.int32))
+
+    def _mark(self, node):
+        if self.changed is not None:
+            self.changed.add(node)
+
+    def _set_links(self, node, layer, neighbours):
+        self._mark(node)
+        if layer == 0:
+            self._links0[node, :len(neighbours)] = neighbours
+            self._counts0[node] = len(neighbours)
+        else:
+            self._upper[layer - 1][node] = np.asarray(neighbours, dtype=np.int32)
+
+    def _connect(self, node, new_neighbour, layer, max_links):
+        links = self._links(node, layer)
+        if len(links) < max_links:
+            self._set_links(node, layer, np.append(links, new_neighbour))
+            return
+        # Over capacity, keep the most useful links according to the selection heuristic
+        candidates = np.append(links, new_neighbour)
+        sims = self._vectors[candidates] @ self._vectors[node]
+        scored = sorted(zip(sims.tolist(), candidates.tolist()), reverse=True)
+        self._set_links(node, layer, self._select(scored, max_links))
+
+    def _select(self, scored, m):
+        """
+        Picks up to m neighbours from (similarity, node) pairs sorted best first, preferring
+        candidates that are closer to the target than to any neighbour already picked.
+        """
+        if not scored:
+            return []
+        nodes = [node for _, node in scored]
+        pairwise = self._vectors[nodes] @ self._vectors[nodes].T
+        closest_selected = np.full(len(nodes), -np.inf, dtype=np.float32)  # Best similarity to any picked node
+        selected, pruned = [], []
+        for i, (sim, node) in enumerate(scored):
+            if len(selected) >= m:
+                break
+            if closest_selected[i] > sim:
+                pruned.append(node)
+            else:
+                selected.append(node)
+                np.maximum(closest_selected, pairwise[i], out=closest_selected)
+        # Fill the remaining slots with the closest pruned candidates to keep the graph well connected
+        selected.extend(pruned[:m - len(selected)])
+        return selected
+
+    def _search_layer(self, vector, entries, ef, layer):
+        visited = set(entries)
+        sims = self._vectors[entries] @ vector
+        candidates = [(-sim, node) for sim, node in zip(sims.tolist(), entries)]
+        heapq.heapify(candidates)
+        results = [(sim, node) for sim, node in zip(sims.tolist(), entries)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_sim < results[0][0]:
+                break
+            neighbours = [n for n in self._links(node, layer).tolist() if n not in visited and self.keys[n] is not None]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            for sim, neighbour in zip((self._vectors[neighbours] @ vector).tolist(), neighbours):
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, neighbour))
+                    heapq.heappush(results, (sim, neighbour))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _pick_entry(self):
+        for layer in range(len(self._upper), 0, -1):
+            if self._upper[layer - 1]:
+                self.entry = next(iter(self._upper[layer - 1]))
+                self.max_level = layer
+                return
+        self.entry = next(iter(self.nodes.values()), None)
+        self.max_level = 0 if self.entry is not None else -1
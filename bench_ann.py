@@ -0,0 +1,75 @@
+"""
+Compares HNSW retrieval against exact search on a synthetic clustered corpus.
+
+Reports recall@k and per-query latency for a range of ef_search values, after a round of deletes
+and re-inserts so the incremental update path is exercised too.
+
+    python bench_ann.py --size 20000 --k 10 --ef 16 32 64 128 256
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ann_index import HNSWIndex
+from vector_index import EmbeddingMatrix
+
+
+def make_corpus(rng, size: int, dim: int, clusters: int):
+    # Title embeddings cluster around people, places and events rather than being uniform
+    centers = rng.standard_normal((clusters, dim))
+    return (centers[rng.integers(0, clusters, size)] + 0.8 * rng.standard_normal((size, dim))).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=128)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = make_corpus(rng, args.size, args.dim, args.clusters)
+    queries = make_corpus(rng, args.queries, args.dim, args.clusters)
+
+    exact = EmbeddingMatrix()
+    approximate = HNSWIndex(m=args.m, ef_construction=args.ef_construction)
+    exact.extend(list(range(args.size)), vectors)
+    start = time.perf_counter()
+    approximate.extend(range(args.size), vectors)
+    build_time = time.perf_counter() - start
+    print(f"Built HNSW over {args.size} x {args.dim} in {build_time:.1f}s ({build_time / args.size * 1000:.2f} ms/insert)")
+
+    # Delete every tenth vector and put half of them back
+    for key in range(0, args.size, 10):
+        exact.remove(key)
+        approximate.remove(key)
+    for key in range(0, args.size, 20):
+        exact.add(key, vectors[key])
+        approximate.add(key, vectors[key])
+
+    start = time.perf_counter()
+    truth = [{key for key, _ in exact.search(query, args.k)} for query in queries]
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    print(f"{'ef_search':>10} {f'recall@{args.k}':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    print(f"{'exact':>10} {1.0:>10.3f} {exact_ms:>8.2f} {'':>8}")
+    for ef in args.ef:
+        hits, latencies = 0, []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = approximate.search(query, args.k, ef=ef)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(expected & {key for key, _ in found})
+        recall = hits / (len(queries) * args.k)
+        print(f"{ef:>10} {recall:>10.3f} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 99):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Measures how the Pensieve tools scale with the number of stored memories.
+
+For every size a synthetic corpus is written into a fresh directory by a separate process, then
+write_memory, get_memories, get_topic_timeline, get_memories_between, delete_memory,
+crystalize_memories and startup are timed against it. Topics follow a Zipf distribution, so a
+few people and places show up in many memories and most only in a handful, and words are
+skewed the same way.
+
+By default a deterministic stub encoder stands in for the sentence transformers, so the numbers
+measure the Pensieve rather than the models and runs need no model downloads. Pass
+--encoder real to include inference.
+
+    python bench_pensieve.py --sizes 1000 10000 100000 1000000 --output bench.json
+
+The JSON output records the commit and settings next to the results, so runs can be compared across commits.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+# Stand-in vocabulary, the generator only needs its size and skew to look like real notes
+WORDS = 20000
+TOPICS = 5000
+WORDS_PER_MEMORY = 90  # Median text length, long tails past CHUNK_WORDS exercise chunking
+SPAN = 5 * 365 * 24 * 3600  # Memories are spread over five years
+
+# The async tools all run on this one loop, so creating a loop is not part of any timing
+event_loop = asyncio.new_event_loop()
+
+
+class StubModel:
+    """
+    Deterministic stand-in for a SentenceTransformer. Every word adds a signed one at a hashed
+    position, so texts that share words still come out similar.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, sentences, **kwargs):
+        texts = [sentences] if isinstance(sentences, str) else sentences
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                h = zlib.crc32(word.encode("utf-8"))
+                embeddings[row, h % self.dim] += 1.0 if h & 1 << 31 else -1.0
+        return embeddings[0] if isinstance(sentences, str) else embeddings
+
+
+def make_corpus(rng, size: int):
+    """
+    Yields write_memories entries with Zipf-distributed words and topics.
+    """
+    for _ in range(size):
+        length = max(int(rng.lognormal(np.log(WORDS_PER_MEMORY), 0.6)), 5)
+        words = [f"w{rank}" for rank in np.minimum(rng.zipf(1.2, length), WORDS) - 1]
+        topics = [f"topic{rank}" for rank in np.minimum(rng.zipf(1.5, rng.integers(1, 5)), TOPICS) - 1]
+        yield {
+            "title": " ".join(words[:6]),
+            "time_delta": int(rng.integers(0, SPAN)),
+            "text": " ".join(words),
+            "extracted_topics": list(dict.fromkeys(topics)),
+        }
+
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+
+def call(function, *args):
+    """
+    Calls a tool, running it to completion if it is a coroutine function.
+    """
+    result = function(*args)
+    return event_loop.run_until_complete(result) if inspect.isawaitable(result) else result
+
+
+def timed(function, arguments):
+    latencies = []
+    for args in arguments:
+        start = time.perf_counter()
+        call(function, *args)
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def disk_size_mb(directory: str):
+    sizes = {}
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            sizes[name] = os.path.getsize(path)
+    cache = sizes.pop("pensieve_embeddings.sqlite", 0)
+    return sum(sizes.values()) / 2**20, cache / 2**20
+
+
+def import_pensieve(directory: str, encoder: str):
+    """
+    Imports main.py against the files in `directory`, with the stub encoder if asked for.
+    """
+    os.chdir(directory)  # The Pensieve keeps its files in the working directory
+    import models
+    if encoder == "stub":
+        models.qa_model._model = StubModel(768)
+        models.similarity_model._model = StubModel(384)
+    import main
+    return main
+
+
+def run_size(args):
+    """
+    Builds a store of args.size memories in args.workdir and times the tools against it.
+    """
+    pensieve = import_pensieve(args.workdir, args.encoder)
+    rng = np.random.default_rng(args.seed)
+    corpus = make_corpus(rng, args.size)
+    result = {"size": args.size}
+
+    # Bulk load, then wait for the background encoding to catch up
+    start = time.perf_counter()
+    batch = []
+    for new_memory in corpus:
+        batch.append(new_memory)
+        if len(batch) >= args.batch_size:
+            call(pensieve.write_memories, batch)
+            batch = []
+    if batch:
+        call(pensieve.write_memories, batch)
+    written = time.perf_counter() - start
+    pensieve.embedding_pipeline.drain()
+    indexed = time.perf_counter() - start
+    result["bulk_write"] = {"seconds": written, "memories_per_s": args.size / written}
+    result["bulk_indexed"] = {"seconds": indexed, "memories_per_s": args.size / indexed}
+
+    start = time.perf_counter()
+    call(pensieve.crystalize_memories)
+    result["crystalize_memories"] = {"seconds": time.perf_counter() - start}
+
+    query_words = [f"w{rank} w{rank + 7}" for rank in rng.integers(0, 2000, args.queries)]
+    query_topics = [f"topic{rank}" for rank in np.minimum(rng.zipf(1.5, args.queries), TOPICS) - 1]
+    windows = [(int(start_delta), int(start_delta) - 30 * 24 * 3600) for start_delta in rng.integers(30 * 24 * 3600, SPAN, args.queries)]
+    result["get_memories"] = timed(pensieve.get_memories, [(query,) for query in query_words])
+    result["get_topic_timeline"] = timed(pensieve.get_topic_timeline, [(topic,) for topic in query_topics])
+    result["get_memories_between"] = timed(pensieve.get_memories_between, windows)
+
+    new_memories = list(make_corpus(np.random.default_rng(args.seed + 1), args.queries))
+    result["write_memory"] = timed(pensieve.write_memory, [tuple(m.values()) for m in new_memories])
+    pensieve.embedding_pipeline.drain()
+    memory_ids = rng.choice(list(pensieve.memories), min(args.queries, len(pensieve.memories)), replace=False)
+    result["delete_memory"] = timed(pensieve.delete_memory, [(int(memory_id),) for memory_id in memory_ids])
+
+    call(pensieve.crystalize_memories)
+    pensieve.embedding_pipeline.close()
+    pensieve.inference.close()
+    result["disk_mb"], result["embedding_cache_mb"] = disk_size_mb(args.workdir)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_startup(args):
+    """
+    Times a cold import of main.py against the store in args.workdir.
+    """
+    start = time.perf_counter()
+    pensieve = import_pensieve(args.workdir, args.encoder)
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "memories": len(pensieve.memories), "peak_rss_mb": peak_rss_mb()}
+
+
+def run_worker(mode: str, args, workdir: str):
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", mode, "--workdir", workdir,
+        "--encoder", args.encoder, "--queries", str(args.queries), "--batch-size", str(args.batch_size),
+        "--seed", str(args.seed), "--sizes", str(args.size),
+    ]
+    # The Pensieve modules are imported from next to this script, whatever the working directory
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)), os.environ.get("PYTHONPATH")]))}
+    completed = subprocess.run(command, capture_output=True, text=True, env=env)
+    if completed.returncode:
+        raise RuntimeError(f"{mode} run for {args.size} memories failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--encoder", choices=["stub", "real"], default="stub")
+    parser.add_argument("--queries", type=int, default=200, help="Calls timed per tool")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--worker", choices=["size", "startup"], help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.size = args.sizes[0]
+        result = run_size(args) if args.worker == "size" else run_startup(args)
+        print(json.dumps(result))
+        return
+
+    results = []
+    print(f"{'size':>9} {'write/s':>9} {'get_memories p50/p99':>21} {'timeline p50/p99':>17} {'startup s':>10} {'rss MB':>8} {'disk MB':>8}")
+    for size in args.sizes:
+        args.size = size
+        with tempfile.TemporaryDirectory(prefix="pensieve-bench-") as workdir:
+            result = run_worker("size", args, workdir)
+            result["startup"] = run_worker("startup", args, workdir)
+        results.append(result)
+        print(
+            f"{size:>9} {result['bulk_indexed']['memories_per_s']:>9.0f} "
+            f"{result['get_memories']['p50_ms']:>10.2f}/{result['get_memories']['p99_ms']:<10.2f}"
+            f"{result['get_topic_timeline']['p50_ms']:>8.2f}/{result['get_topic_timeline']['p99_ms']:<8.2f} "
+            f"{result['startup']['seconds']:>10.2f} {result['peak_rss_mb']:>8.0f} {result['disk_mb']:>8.1f}"
+        )
+
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "encoder": args.encoder,
+            "queries": args.queries,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Checks the chatbot's history compaction and tool declaration cache against a stub Gemini client,
+so neither needs an API key or a running memory server.
+
+- HistoryManager.compact is fed a long conversation with large tool results and a small budget.
+  The history must end up under budget, keep the latest turns with their tool results intact,
+  keep only digests of the older tool results, and start with the summary the stub client wrote.
+- load_tool_declarations is called on fake MCP tools in a temporary directory. The first call must
+  write the cache, the second must be served from it, and a changed tool must rebuild it.
+
+    python check_chat_history.py
+
+Exits with status 1 if any check fails.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from types import SimpleNamespace
+
+from google.genai import types
+from mcp import types as mcp_types
+
+import gemini_chatbot
+from gemini_chatbot import HistoryManager, estimate_tokens, is_user_message, load_tool_declarations
+
+STUB_SUMMARY = "The user asked about Alice's birthday and her trip to Lisbon."
+
+
+class StubModels:
+    def __init__(self):
+        self.requests = []
+
+    async def generate_content(self, model, contents, config=None):
+        self.requests.append(contents)
+        return types.GenerateContentResponse(candidates=[
+            types.Candidate(content=types.Content(role="model", parts=[types.Part(text=STUB_SUMMARY)]))
+        ])
+
+
+class StubClient:
+    """Stands in for genai.Client, only the async generate_content used by the summarizer."""
+
+    def __init__(self):
+        self.aio = SimpleNamespace(models=StubModels())
+
+
+def conversation(turns: int):
+    history = []
+    for i in range(turns):
+        history.append(types.Content(role="user", parts=[types.Part(text=f"What do you remember about question {i}?")]))
+        history.append(types.Content(role="model", parts=[
+            types.Part(function_call=types.FunctionCall(name="get_memories", args={"query": f"question {i}"}))
+        ]))
+        history.append(types.Content(role="user", parts=[
+            types.Part.from_function_response(name="get_memories", response={"result": "x" * 1200})
+        ]))
+        history.append(types.Content(role="model", parts=[types.Part(text=f"Here is what I found about question {i}.")]))
+    return history
+
+
+def check_history(failures: list):
+    client = StubClient()
+    manager = HistoryManager(budget=1500, keep_turns=2)
+    history = conversation(20)
+    latest = [content.parts[0].text for content in history if is_user_message(content)][-manager.keep_turns:]
+    before = estimate_tokens(history)
+
+    asyncio.run(manager.compact(history, client))
+    after = estimate_tokens(history)
+    print(json.dumps({"tokens_before": before, "tokens_after": after, "budget": manager.budget, "turns_after": len(history)}, indent=2))
+
+    if after > manager.budget:
+        failures.append(f"history is {after} tokens, over the budget of {manager.budget}")
+    kept = [content.parts[0].text for content in history if is_user_message(content)]
+    if kept[-manager.keep_turns:] != latest:
+        failures.append(f"the latest {manager.keep_turns} user messages were not kept verbatim")
+    results = [part.function_response.response for content in history for part in content.parts if part.function_response]
+    if any("digest" in response for response in results[-manager.keep_turns:]):
+        failures.append(f"tool results of the latest {manager.keep_turns} turns were digested")
+    if not all("digest" in response for response in results[:-manager.keep_turns]):
+        failures.append("older tool results were kept in full")
+    if len(client.aio.models.requests) != 1:
+        failures.append(f"expected one summarize request, got {len(client.aio.models.requests)}")
+    if STUB_SUMMARY not in (history[0].parts[0].text or ""):
+        failures.append("the history does not start with the summary turn")
+
+
+def fake_tools(description: str = "Searches the stored memories."):
+    return [
+        mcp_types.Tool(name="get_memories", description=description, inputSchema={
+            "type": "object",
+            "properties": {"query": {"type": "string", "title": "Query"}},
+            "required": ["query"],
+        }),
+        mcp_types.Tool(name="write_memory", description="Stores a memory.", inputSchema={
+            "type": "object",
+            "properties": {"title": {"type": "string"}, "text": {"type": "string"}},
+            "required": ["title", "text"],
+        }),
+    ]
+
+
+def declared_description(tools):
+    return tools[0].function_declarations[0].description
+
+
+def check_declarations(failures: list):
+    with tempfile.TemporaryDirectory() as directory:
+        gemini_chatbot.TOOL_DECLARATIONS_CACHE = os.path.join(directory, "gemini_tool_declarations.json")
+
+        first = load_tool_declarations(fake_tools())
+        if len(first) != 2 or not os.path.exists(gemini_chatbot.TOOL_DECLARATIONS_CACHE):
+            failures.append("the first load did not convert both tools and write the cache")
+            return
+
+        # Mark the cached copy, a hit returns the mark while a rebuild would not
+        with open(gemini_chatbot.TOOL_DECLARATIONS_CACHE, encoding="utf-8") as f:
+            cached = json.load(f)
+        cached["declarations"][0]["description"] = "from the cache"
+        with open(gemini_chatbot.TOOL_DECLARATIONS_CACHE, "w", encoding="utf-8") as f:
+            json.dump(cached, f)
+        if declared_description(load_tool_declarations(fake_tools())) != "from the cache":
+            failures.append("unchanged tools were converted again instead of read from the cache")
+
+        if declared_description(load_tool_declarations(fake_tools("Changed."))) != "Changed.":
+            failures.append("a changed tool was served from the stale cache")
+
+
+def main():
+    failures = []
+    check_history(failures)
+    check_declarations(failures)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("All checks passed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
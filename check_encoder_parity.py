@@ -0,0 +1,119 @@
+"""
+Checks an encoder backend against the stock fp32 models before switching ENCODER_BACKEND.
+
+Memories are read from a JSONL file laid out like the import_memories.py input. For the QA model
+the text chunks are the corpus and the titles are the queries. For the similarity model the topic
+names are both. Each text is encoded by fp32 torch and by the candidate backend, and the report shows:
+
+- the cosine similarity of the two embeddings of every text (mean, 1st percentile and minimum)
+- how many of the fp32 top-k results the candidate's top-k shares per query, and how often the first hit agrees
+- single-text encode latency of both, which is what a get_memories call pays
+
+    python check_encoder_parity.py memories.jsonl --backend int8 --threads 4 --max-seq-length 256
+
+Exits with status 1 if the mean cosine or the mean overlap falls below --min-cosine or --min-overlap.
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from models import chunk_text, load_sentence_transformer, qa_model, similarity_model
+
+
+def read_corpus(path: str, args):
+    titles, chunks, topics = [], [], {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            titles.append(entry[args.title_field])
+            chunks.extend(chunk_text(entry.get(args.text_field, "")))
+            entry_topics = entry.get(args.topics_field, [])
+            for name in [entry_topics] if isinstance(entry_topics, str) else entry_topics:
+                topics.setdefault(name.lower(), name)
+            if len(titles) >= args.limit:
+                break
+    return titles, chunks, list(topics.values())
+
+
+def normalized(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def single_text_ms(model, texts):
+    start = time.perf_counter()
+    for text in texts:
+        model.encode(text)
+    return (time.perf_counter() - start) / len(texts) * 1000
+
+
+def compare(model_name: str, queries: list, corpus: list, args):
+    reference = load_sentence_transformer(model_name, "torch", threads=args.threads)
+    candidate = load_sentence_transformer(model_name, args.backend, args.max_seq_length, args.threads)
+
+    texts = list(dict.fromkeys(queries + corpus))
+    agreement = np.sum(normalized(reference.encode(texts)) * normalized(candidate.encode(texts)), axis=1)
+
+    k = min(args.k, len(corpus))
+    rankings = []
+    for model in (reference, candidate):
+        scores = normalized(model.encode(queries)) @ normalized(model.encode(corpus)).T
+        rankings.append(np.argsort(-scores, axis=1)[:, :k])
+    overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(*rankings)])
+    top1 = np.mean(rankings[0][:, 0] == rankings[1][:, 0])
+
+    sample = queries[:args.latency_samples]
+    return {
+        "model": model_name,
+        "texts": len(texts),
+        "queries": len(queries),
+        "cosine_mean": float(agreement.mean()),
+        "cosine_p1": float(np.percentile(agreement, 1)),
+        "cosine_min": float(agreement.min()),
+        f"overlap@{k}": float(overlap),
+        "top1_agreement": float(top1),
+        "fp32_ms": single_text_ms(reference, sample),
+        f"{args.backend}_ms": single_text_ms(candidate, sample),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSONL file with one memory per line")
+    parser.add_argument("--backend", choices=["int8", "onnx", "torch"], default="int8")
+    parser.add_argument("--max-seq-length", type=int, default=0, help="0 keeps each model's own limit")
+    parser.add_argument("--threads", type=int, default=0, help="0 leaves it to the library")
+    parser.add_argument("--limit", type=int, default=2000, help="Memories read from the file")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--latency-samples", type=int, default=50)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--min-overlap", type=float, default=0.9)
+    parser.add_argument("--title-field", default="title")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--topics-field", default="extracted_topics")
+    args = parser.parse_args()
+
+    titles, chunks, topics = read_corpus(args.path, args)
+    results = [compare(qa_model.model_name, titles, chunks, args)]
+    if len(topics) > 1:
+        results.append(compare(similarity_model.model_name, topics, topics, args))
+    else:
+        print(f"Skipping {similarity_model.model_name}, the file has fewer than two topics")
+
+    passed = True
+    for result in results:
+        print(json.dumps(result, indent=2))
+        overlap = next(value for key, value in result.items() if key.startswith("overlap@"))
+        if result["cosine_mean"] < args.min_cosine or overlap < args.min_overlap:
+            print(f"{result['model']}: {args.backend} is below --min-cosine {args.min_cosine} or --min-overlap {args.min_overlap}")
+            passed = False
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import atexit
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger("pensieve")
+
+# Keys per lookup query, well under SQLite's bound parameter limit
+SQL_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings, keyed by model name plus a hash of the text.
+
+    Lookups go through a size-limited in-memory LRU first and fall back to a SQLite file that
+    survives restarts, so the same string is never run through a transformer twice.
+
+    New embeddings reach the file in batches, written on a background thread of their own every
+    `flush_interval` seconds, so encoding never waits on the disk. The file keeps at most
+    `max_disk_entries` embeddings and drops the oldest written first. Embeddings stored with
+    persist=False, like those of one-off queries, only ever go to the in-memory tier.
+    """
+
+    def __init__(self, path: str, max_entries: int = 4096, max_disk_entries: int = 100_000, flush_interval: float = 2.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._recent = OrderedDict()  # key -> embedding, least recently used first
+        self._pending = {}  # key -> vector bytes waiting to be written to the file
+        self._lock = threading.Lock()
+        self._db = None
+        self._writer = None
+        self._writer_db = None
+        self._disk_entries = 0  # Rows in the file, counted when the writer starts and overestimated after that
+        self._closing = threading.Event()
+
+    def get_many(self, model_name: str, texts: list[str]):
+        """
+        Looks up the embeddings of `texts`.
+
+        Returns:
+            list: One embedding per text, or None where the text has not been encoded before.
+        """
+        keys = [cache_key(model_name, text) for text in texts]
+        found = [None] * len(keys)
+        with self._lock:
+            on_disk = []
+            for i, key in enumerate(keys):
+                if key in self._recent:
+                    self._recent.move_to_end(key)
+                    found[i] = self._recent[key]
+                elif key in self._pending:
+                    found[i] = _read_only(np.frombuffer(self._pending[key], dtype=np.float32))
+                    self._remember(key, found[i])
+                else:
+                    on_disk.append(i)
+
+            vectors = {}
+            for start in range(0, len(on_disk), SQL_BATCH_SIZE):
+                batch = [keys[i] for i in on_disk[start:start + SQL_BATCH_SIZE]]
+                rows = self._connect().execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                # frombuffer arrays are read-only, just like the ones handed out from memory
+                vectors.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            for i in on_disk:
+                if keys[i] in vectors:
+                    found[i] = vectors[keys[i]]
+                    self._remember(keys[i], found[i])
+
+            missing = sum(embedding is None for embedding in found)
+            self.hits += len(found) - missing
+            self.misses += missing
+        return found
+
+    def put_many(self, model_name: str, texts: list[str], embeddings, persist: bool = True):
+        """
+        Stores freshly computed embeddings in memory, and queues them for the file unless persist is False.
+        """
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = cache_key(model_name, text)
+                embedding = _read_only(embedding)
+                self._remember(key, embedding)
+                if persist:
+                    self._pending[key] = embedding.tobytes()
+            if persist and self._writer is None and not self._closing.is_set():
+                self._writer = threading.Thread(target=self._write_loop, name="embedding-cache-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+
+    def flush(self):
+        """
+        Writes the queued embeddings to the file in one transaction, then evicts the oldest rows
+        if the file is over max_disk_entries.
+        """
+        with self._lock:
+            rows = list(self._pending.items())
+        if not rows:
+            return
+        db = self._connect_writer()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._disk_entries += len(rows)
+            if self.max_disk_entries and self._disk_entries > self.max_disk_entries:
+                count = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                # Evict down to 90% so this does not run again on the next few writes
+                excess = max(count - self.max_disk_entries * 9 // 10, 0)
+                db.execute("DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)", (excess,))
+                self._disk_entries = count - excess
+        with self._lock:
+            # Readers look in _pending until the rows are committed, so they never miss both
+            for key, vector in rows:
+                if self._pending.get(key) is vector:
+                    del self._pending[key]
+
+    def close(self):
+        """
+        Writes what is still queued and stops the writer thread.
+        """
+        self._closing.set()
+        if self._writer is not None:
+            self._writer.join()
+        self.flush()
+
+    def _write_loop(self):
+        while not self._closing.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.warning("Could not write embeddings to the cache file: %s", e)
+
+    def _remember(self, key, embedding):
+        self._recent[key] = embedding
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_entries:
+            self._recent.popitem(last=False)
+
+    def _connect(self):
+        if self._db is None:
+            self._db = open_cache_db(self.path)
+        return self._db
+
+    def _connect_writer(self):
+        # Writes get a connection of their own, WAL lets them commit while lookups read
+        if self._writer_db is None:
+            self._writer_db = open_cache_db(self.path)
+            self._disk_entries = self._writer_db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self._writer_db
+
+
+def open_cache_db(path: str):
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")  # It is a cache, a crash may lose the last writes but never corrupts it
+    db.execute("PRAGMA busy_timeout=10000")
+    db.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+    return db
+
+
+def cache_key(model_name: str, text: str):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+
+def _read_only(embedding):
+    # Cached arrays are shared between callers, so nobody gets to modify them in place
+    embedding = np.array(embedding, dtype=np.float32)
+    embedding.setflags(write=False)
+    return embedding
+
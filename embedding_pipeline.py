@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("pensieve")
+
+
+def encode_batch(jobs):
+    """
+    Encodes the texts of many jobs with one `encode` call per encoder.
+
+    Args:
+        jobs (list): (key, encoder, texts) tuples.
+    Returns:
+        list: (key, embeddings) pairs in job order, with one embedding row per text.
+    """
+    by_encoder = {}
+    for job in jobs:
+        by_encoder.setdefault(id(job[1]), []).append(job)
+
+    encoded = {}
+    for encoder_jobs in by_encoder.values():
+        encoder = encoder_jobs[0][1]
+        embeddings = encoder.encode([text for _, _, texts in encoder_jobs for text in texts])
+        offset = 0
+        for key, _, texts in encoder_jobs:
+            encoded[key] = embeddings[offset:offset + len(texts)]
+            offset += len(texts)
+    return [(key, encoded[key]) for key, _, _ in jobs]
+
+
+class EmbeddingPipeline:
+    """
+    Encodes texts on background worker threads so writes do not wait for the models.
+
+    Jobs are (key, encoder, texts) tuples. A worker takes every job that is waiting, up to
+    `max_batch_texts` texts, encodes them with one call per encoder and passes the
+    (key, embeddings) results to `on_encoded`. If encoding fails the keys go to `on_failed`.
+    Workers are started by the first `submit`. `encode` does the encoding, encode_batch by
+    default, and can hand it to an inference executor instead.
+    """
+
+    def __init__(self, on_encoded, on_failed, workers: int = 1, max_batch_texts: int = 256, encode=encode_batch):
+        self.on_encoded = on_encoded
+        self.on_failed = on_failed
+        self.encode = encode
+        self.workers = workers
+        self.max_batch_texts = max_batch_texts
+        self.batches = 0
+        self.texts_encoded = 0
+        self.encode_seconds = 0.0
+        self._queue = deque()
+        self._in_flight = 0
+        self._closing = False
+        self._threads = []
+        self._condition = threading.Condition()
+
+    @property
+    def queue_depth(self):
+        """
+        Jobs waiting to be encoded or being encoded right now.
+        """
+        with self._condition:
+            return len(self._queue) + self._in_flight
+
+    def submit(self, jobs):
+        if not jobs:
+            return
+        with self._condition:
+            if not self._threads:
+                self._closing = False
+                for i in range(self.workers):
+                    thread = threading.Thread(target=self._work, name=f"embedding-worker-{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+            self._queue.extend(jobs)
+            self._condition.notify_all()
+
+    def drain(self, timeout: float = None):
+        """
+        Waits until every submitted job has been encoded.
+
+        Returns:
+            bool: False if the timeout expired first.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._queue and not self._in_flight, timeout)
+
+    def close(self):
+        """
+        Finishes the queued jobs and stops the workers.
+        """
+        self.drain()
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._closing)
+                if not self._queue:
+                    return
+                # Micro-batch everything that piled up while the previous batch was encoding
+                jobs, texts = [], 0
+                while self._queue and (not jobs or texts + len(self._queue[0][2]) <= self.max_batch_texts):
+                    job = self._queue.popleft()
+                    jobs.append(job)
+                    texts += len(job[2])
+                self._in_flight += len(jobs)
+
+            try:
+                start = time.perf_counter()
+                results = self.encode(jobs)
+                self.encode_seconds += time.perf_counter() - start
+                self.on_encoded(results)
+                self.batches += 1
+                self.texts_encoded += texts
+            except Exception:
+                logger.exception("Failed to encode a batch of %d jobs", len(jobs))
+                self.on_failed([key for key, _, _ in jobs])
+            finally:
+                with self._condition:
+                    self._in_flight -= len(jobs)
+                    self._condition.notify_all()
@@ -1,6 +1,9 @@
 from google import genai
 from google.genai import types
 import os
+import json
+import asyncio
+import hashlib
 from typing import Optional
 from dotenv import load_dotenv
 from google.genai.types import FunctionDeclaration, Schema, JSONSchema
@@ -53,24 +56,7 @@ async def chat_loop(client):
 
             # List available tools
             t = await session.list_tools()
-            google_tools = []
-            for tool in t.tools:
-                try:
-                    # Convert the JSON schema to a Gemini Schema object
-                    schema = Schema.from_json_schema(json_schema=JSONSchema(**tool.inputSchema))
-                    
-                    # Create the function declaration with the converted schema
-                    func_decl = FunctionDeclaration(
-                        name=tool.name,
-                        description=tool.description or "",
-                        parameters=schema
-                    )
-                    
-                    # Add the tool with the function declaration
-                    google_tools.append(types.Tool(function_declarations=[func_decl]))
-                except Exception as e:
-                    print(f"⚠️ Failed to convert schema for tool '{tool.name}': {str(e)}")
-                    continue
+            google_tools = load_tool_declarations(t.tools)
 
             print("\n📋 Available Memory Components:")
             print("-"*60)
@@ -79,11 +65,11 @@ async def chat_loop(client):
             print(f"🛠️  Tools: {len(t.tools)} available")
             print("-"*60 + "\n")
 
-            print("🔍 Attempting to access memory resource...")
+            print("🔍 Attempting to access memory summary...")
             try:
-                memory = await session.read_resource("memory:://")
-                print("✅ Successfully retrieved memory resource")
-                print(f"   Memories: {memory}")
+                summary = await session.read_resource("summary://")
+                print("✅ Successfully retrieved memory summary")
+                print(f"   Summary: {summary.contents[0].text}")
             except Exception as e:
                 print(f"❌ Failed to access memory resource: {str(e)}")
 
@@ -91,6 +77,7 @@ async def chat_loop(client):
             
             # Initialize conversation history
             conversation_history = []
+            history_manager = HistoryManager()
             
             while True:
                 try:
@@ -112,7 +99,7 @@ async def chat_loop(client):
                     ))
 
                     # Process the conversation with the model
-                    await process_conversation(client, conversation_history, google_tools, session)
+                    await process_conversation(client, conversation_history, google_tools, session, history_manager)
 
                 except KeyboardInterrupt:
                     print("\n👋 Goodbye! Have a great day! 😊")
@@ -120,102 +107,293 @@ async def chat_loop(client):
                 except Exception as e:
                     print(f"\n⚠️  An error occurred: {str(e)}\n")
 
+TOOL_DECLARATIONS_CACHE = "gemini_tool_declarations.json"
+
+def load_tool_declarations(tools):
+    """
+    Convert the MCP tools to Gemini tools. The conversion is cached on disk, keyed by a hash of the
+    tool list, so it only runs again when the server's tools change.
+    """
+    key = hashlib.sha256(json.dumps([tool.model_dump(mode="json") for tool in tools], sort_keys=True).encode()).hexdigest()
+    try:
+        with open(TOOL_DECLARATIONS_CACHE, encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached["key"] == key:
+            return [types.Tool(function_declarations=[FunctionDeclaration.model_validate(d)]) for d in cached["declarations"]]
+    except (OSError, ValueError, KeyError):
+        pass  # No cache yet, or one we cannot read, it is rebuilt below
+
+    declarations = []
+    for tool in tools:
+        try:
+            # Convert the JSON schema to a Gemini Schema object
+            schema = Schema.from_json_schema(json_schema=JSONSchema(**tool.inputSchema))
+
+            # Create the function declaration with the converted schema
+            declarations.append(FunctionDeclaration(
+                name=tool.name,
+                description=tool.description or "",
+                parameters=schema
+            ))
+        except Exception as e:
+            print(f"⚠️ Failed to convert schema for tool '{tool.name}': {str(e)}")
+            continue
+
+    try:
+        with open(TOOL_DECLARATIONS_CACHE, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "declarations": [d.model_dump(mode="json", exclude_none=True) for d in declarations]}, f)
+    except OSError as e:
+        print(f"⚠️ Could not cache tool declarations: {str(e)}")
+    # Add each tool with its function declaration
+    return [types.Tool(function_declarations=[d]) for d in declarations]
+
+# History sent with every request is kept under this many tokens, estimated at CHARS_PER_TOKEN
+HISTORY_TOKEN_BUDGET = 32000
+CHARS_PER_TOKEN = 4
+HISTORY_KEEP_TURNS = 4  # The latest user messages are kept verbatim, together with their tool results
+TOOL_DIGEST_CHARS = 300  # What is left of an older tool result
+SUMMARIZE_HISTORY = True  # Have the model summarize turns that no longer fit instead of just dropping them
+SUMMARY_PROMPT = "Summarize this conversation between a user and a memory assistant in a short paragraph. Keep names, dates, memory ids and any decisions made."
+
+class HistoryManager:
+    """
+    Keeps the conversation history sent to Gemini under a token budget.
+
+    Tool results older than the last few user messages are collapsed into short digests first.
+    If the history is still over budget, the oldest turns are replaced by a summary written by
+    the model, or dropped if summarizing is off or fails. Cuts are only made in front of a user
+    message, so function calls always stay next to their responses.
+    """
+
+    def __init__(self, budget: int = HISTORY_TOKEN_BUDGET, keep_turns: int = HISTORY_KEEP_TURNS, summarize: bool = SUMMARIZE_HISTORY):
+        self.budget = budget
+        self.keep_turns = keep_turns
+        self.summarize = summarize
+
+    async def compact(self, conversation_history, client):
+        """Shrink conversation_history in place until it fits the budget."""
+        if estimate_tokens(conversation_history) <= self.budget:
+            return
+
+        starts = [i for i, content in enumerate(conversation_history) if is_user_message(content)]
+        recent = starts[-self.keep_turns] if len(starts) >= self.keep_turns else 0
+        for i in range(recent):
+            conversation_history[i] = digest_tool_results(conversation_history[i])
+        if estimate_tokens(conversation_history) <= self.budget:
+            return
+
+        # Keep as many recent turns as fit, and always the latest user message
+        cut = next((s for s in starts if estimate_tokens(conversation_history[s:]) <= self.budget * 3 // 4), starts[-1] if starts else 0)
+        if cut == 0:
+            return
+        dropped = conversation_history[:cut]
+        summary = await self.summarize_turns(dropped, client) if self.summarize else None
+        conversation_history[:cut] = summary_turns(summary) if summary else []
+
+    async def summarize_turns(self, contents, client):
+        try:
+            response = await client.aio.models.generate_content(
+                model=MODEL,
+                contents=[types.Content(role="user", parts=[types.Part(text=f"{SUMMARY_PROMPT}\n\n{transcript(contents)}")])],
+            )
+            return response.text
+        except Exception as e:
+            print(f"\n⚠️ Could not summarize the earlier conversation, dropping it instead: {str(e)}")
+            return None
+
+def is_user_message(content):
+    return content.role == "user" and any(part.text for part in content.parts or [])
+
+def estimate_tokens(contents):
+    """Rough token count of the history, from the size of its text and function payloads."""
+    chars = 0
+    for content in contents:
+        for part in content.parts or []:
+            if part.text:
+                chars += len(part.text)
+            elif part.function_call:
+                chars += len(part.function_call.name or "") + len(json.dumps(part.function_call.args or {}, default=str))
+            elif part.function_response:
+                chars += len(json.dumps(part.function_response.response or {}, default=str))
+    return chars // CHARS_PER_TOKEN
+
+def digest_tool_results(content):
+    """Replace the function responses in a turn with the start of their text."""
+    if not any(part.function_response for part in content.parts or []):
+        return content
+    parts = []
+    for part in content.parts:
+        response = part.function_response.response if part.function_response else None
+        if response is None or "digest" in response:
+            parts.append(part)
+            continue
+        text = json.dumps(response, default=str)
+        digest = text if len(text) <= TOOL_DIGEST_CHARS else f"{text[:TOOL_DIGEST_CHARS]}... ({len(text) - TOOL_DIGEST_CHARS} more characters)"
+        parts.append(types.Part.from_function_response(name=part.function_response.name, response={"digest": digest}))
+    return types.Content(role=content.role, parts=parts)
+
+def transcript(contents):
+    """Plain text rendering of history turns, for the summarizer."""
+    lines = []
+    for content in contents:
+        speaker = "User" if content.role == "user" else "Gemini"
+        for part in content.parts or []:
+            if part.text:
+                lines.append(f"{speaker}: {part.text}")
+            elif part.function_call:
+                lines.append(f"Gemini called {part.function_call.name}({json.dumps(part.function_call.args or {}, default=str)})")
+            elif part.function_response:
+                text = json.dumps(part.function_response.response or {}, default=str)
+                lines.append(f"{part.function_response.name} returned: {text[:TOOL_DIGEST_CHARS]}")
+    return "\n".join(lines)
+
+def summary_turns(summary):
+    """The user and model turns that stand in for the summarized part of the conversation."""
+    return [
+        types.Content(role="user", parts=[types.Part(text=f"Summary of our earlier conversation: {summary}")]),
+        types.Content(role="model", parts=[types.Part(text="Understood, I will keep that in mind.")]),
+    ]
+
 SYSTEM_PROMPT = """
 You are a memory storage machine. Your job is to create, read, update, and delete memories based on the desires of the user. Avoid tampering with memories without explicit user intent. When retrieving the memories, try to summarize their contents in a paragraph or two.
 """
-async def process_conversation(client, conversation_history, google_tools, session):
+MODEL = "gemini-2.5-flash-preview-05-20"
+STREAM_RESPONSES = True  # Print the model's text as it is generated rather than once its turn is complete
+
+async def process_conversation(client, conversation_history, google_tools, session, history_manager=None):
     """Handle the conversation with the model, including function calling."""
     print("\n\033[1;35mGemini:\033[0m ", end="", flush=True)
     max_iterations = 5  # Prevent infinite loops
 
     for _ in range(max_iterations):
         try:
+            # Tool results pile up fastest, so the history is checked before every request
+            if history_manager is not None:
+                await history_manager.compact(conversation_history, client)
+
             # Generate the response with function calling enabled
-            response = client.models.generate_content(
-                model="gemini-2.5-flash-preview-05-20",
-                contents=conversation_history,
-                config=types.GenerateContentConfig(
-                    tools=google_tools,
-                    system_instruction=SYSTEM_PROMPT
-                )
-            )
+            content = await generate_response(client, conversation_history, google_tools)
 
             # Process the response
-            if not response.candidates:
+            if content is None:
                 print("\n⚠️ No response generated")
                 return
-
-            candidate = response.candidates[0]
-            if not candidate.content or not candidate.content.parts:
+            if not content.parts:
                 print("\n⚠️ Empty response from model")
                 return
 
-            function_called = False
-            for part in candidate.content.parts:
-                if part.function_call:
-                    function_called = True
-                    await handle_function_call(candidate.content, part, conversation_history, session)
-                elif part.text:
-                    display_text_response(part.text, conversation_history)
+            # The model's turn goes into the history once, text and function calls together
+            conversation_history.append(content)
+            if not STREAM_RESPONSES:
+                for part in content.parts:
+                    if part.text:
+                        display_text_response(part.text)
 
-            if not function_called:
+            function_calls = [part.function_call for part in content.parts if part.function_call]
+            if not function_calls:
                 return
-                
+
+            # Calls in the same turn are independent, so they run concurrently. gather keeps their
+            # order, and all the responses go back to the model as one turn.
+            response_parts = await asyncio.gather(*(handle_function_call(call, session) for call in function_calls))
+            conversation_history.append(
+                types.Content(
+                    role="user",
+                    parts=list(response_parts)
+                )
+            )
+
         except Exception as e:
             print(f"\n⚠️  Error generating response: {str(e)}")
             return
 
-async def handle_function_call(content, part, conversation_history, session):
-    """Handle a function call from the model."""
-    func_name = part.function_call.name
-    func_args = part.function_call.args
+async def generate_response(client, conversation_history, google_tools):
+    """
+    Ask the model for its next turn without blocking the event loop.
+
+    Returns:
+        types.Content: The model's turn, or None if no candidate came back.
+    """
+    config = types.GenerateContentConfig(
+        tools=google_tools,
+        system_instruction=SYSTEM_PROMPT
+    )
+    if not STREAM_RESPONSES:
+        response = await client.aio.models.generate_content(model=MODEL, contents=conversation_history, config=config)
+        return response.candidates[0].content if response.candidates else None
+
+    # Print text as it streams in and put the turn back together from the chunks
+    parts = []
+    text = ""
+    received = False
+    async for chunk in await client.aio.models.generate_content_stream(model=MODEL, contents=conversation_history, config=config):
+        if not chunk.candidates:
+            continue
+        received = True
+        chunk_content = chunk.candidates[0].content
+        for part in (chunk_content.parts or []) if chunk_content else []:
+            if part.function_call:
+                if text:
+                    parts.append(types.Part(text=text))
+                    text = ""
+                parts.append(part)
+            elif part.text:
+                if not text and not any(p.text for p in parts):
+                    print("\n    ", end="")
+                print(part.text.replace('\n', '\n    '), end="", flush=True)
+                text += part.text
+    if text:
+        parts.append(types.Part(text=text))
+    if any(part.text for part in parts):
+        print("\n")
+        print("─" * 60)  # Separator line
+    return types.Content(role="model", parts=parts) if received else None
+
+async def handle_function_call(function_call, session):
+    """
+    Handle a function call from the model.
+
+    Returns:
+        types.Part: The function response to send back to the model.
+    """
+    func_name = function_call.name
+    func_args = function_call.args
 
     print(f"\n🔧 Calling function: {func_name}")
     print(f"   Arguments: {func_args}")
 
-    conversation_history.append(content)
-
     try:
         tool_response = await session.call_tool(
             name=func_name,
             arguments=func_args
         )
-        response_part = types.Part.from_function_response(
+        result = tool_result_text(tool_response)
+        print(f"✅ Function call {func_name} successful")
+        print(f"Tool Response: {result}")
+        return types.Part.from_function_response(
             name=func_name,
-            response={"result": tool_response}
+            response={"error" if tool_response.isError else "result": result}
         )
-        print("✅ Function call successful")
-        print(f"Tool Response: {tool_response}")
     except Exception as e:
         error_msg = f"Error calling function {func_name}: {str(e)}"
         print(f"\n⚠️ {error_msg}")
-        response_part = types.Part.from_function_response(
+        return types.Part.from_function_response(
             name=func_name,
             response={"error": error_msg}
         )
 
-    # Add the function call and response to the conversation history
-    conversation_history.append(
-        types.Content(
-            role="user",
-            parts=[response_part]
-        )
-    )
+def tool_result_text(tool_response):
+    """The text of an MCP tool result, which is all the model needs from it."""
+    texts = [item.text for item in tool_response.content if getattr(item, "text", None) is not None]
+    return "\n".join(texts) if texts else str(tool_response.content)
 
-def display_text_response(text, conversation_history):
-    """Display a text response and add it to the conversation history."""
-    conversation_history.append(
-        types.Content(
-            role="model",
-            parts=[types.Part(text=text)]
-        )
-    )
+def display_text_response(text):
+    """Display a text response."""
     formatted_response = text.replace('\n', '\n    ')
     print(f"\n    {formatted_response}\n")
     print("─" * 60)  # Separator line
 
 def main():
-    import asyncio
     try:
         client = configure_gemini()
         print("✅ Successfully connected to Gemini API!")
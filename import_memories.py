@@ -0,0 +1,66 @@
+"""
+Imports memories from a JSONL file straight into the Pensieve, without going through the MCP server.
+
+Each line is a JSON object. By default the fields are named like the write_memory arguments
+(title, text, extracted_topics, time_delta), and the field flags map other layouts onto them:
+
+    python import_memories.py requests.jsonl --text-field body --topics-field none
+
+Memories are written in batches through write_memories, so titles and topic names are encoded
+in batched calls, and the Pensieve is crystalized once every embedding is in. Do not run this while the
+server is running against the same files.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import main as pensieve
+
+
+def read_memories(path: str, args):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            topics = entry.get(args.topics_field, []) if args.topics_field != "none" else []
+            yield pensieve.NewMemory(
+                title=entry[args.title_field],
+                time_delta=int(entry.get(args.time_delta_field, 0)),
+                text=entry.get(args.text_field, ""),
+                extracted_topics=[topics] if isinstance(topics, str) else list(topics),
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSONL file with one memory per line")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--title-field", default="title")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--topics-field", default="extracted_topics", help="'none' to import without topics")
+    parser.add_argument("--time-delta-field", default="time_delta")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    imported = 0
+    batch = []
+    for new_memory in read_memories(args.path, args):
+        batch.append(new_memory)
+        if len(batch) >= args.batch_size:
+            asyncio.run(pensieve.write_memories(batch))
+            imported += len(batch)
+            batch = []
+    if batch:
+        asyncio.run(pensieve.write_memories(batch))
+        imported += len(batch)
+
+    pensieve.embedding_pipeline.drain()
+    print(asyncio.run(pensieve.crystalize_memories()))
+    elapsed = time.perf_counter() - start
+    print(f"Imported {imported} memories in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.0f} memories/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import multiprocessing
+import sys
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from importlib.machinery import ModuleSpec
+
+from inference_worker import encode_in_worker, load_worker_models
+
+logger = logging.getLogger("pensieve")
+
+
+class InferenceExecutor:
+    """
+    Runs model inference off the event loop, on a pool of threads or of processes.
+
+    Requests are (encoder, texts) pairs. A dispatcher thread hands them to the pool as workers
+    free up, merging every waiting request for the same encoder, and with the same persist flag
+    for the embedding cache, into one `encode` call of at
+    most `max_batch_texts` texts. Concurrent tool calls therefore share forward passes, and the
+    batches grow with the load instead of waiting on a timer.
+
+    With kind="thread" the workers call the encoders of this process. With kind="process" each
+    worker process loads its own copy of the models once, and encoders are sent by model name,
+    so inference runs on as many cores as there are workers. Workers are spawned rather than
+    forked, and import only inference_worker.py.
+
+    The first request starts the dispatcher thread, which starts the pool before handing out any
+    work. `submit` only ever queues, so callers on the event loop never wait for workers to load.
+    """
+
+    def __init__(self, kind: str = "thread", workers: int = 1, max_batch_texts: int = 64):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown inference executor {kind!r}")
+        self.kind = kind
+        self.workers = workers
+        self.max_batch_texts = max_batch_texts
+        self.batches = 0
+        self.texts_encoded = 0
+        self._queue = deque()  # (encoder, texts, persist, future), oldest first
+        self._busy = 0  # Batches handed to the pool and not finished yet
+        self._closing = False
+        self._pool = None
+        self._dispatcher = None
+        self._condition = threading.Condition()
+
+    def submit(self, encoder, texts: list[str], persist: bool = True):
+        """
+        Queues texts for encoding. With persist=False their embeddings are only cached in memory.
+
+        Returns:
+            concurrent.futures.Future: Resolves to one embedding row per text.
+        """
+        future = Future()
+        with self._condition:
+            self._start()
+            self._queue.append((encoder, texts, persist, future))
+            self._condition.notify_all()
+        return future
+
+    async def encode(self, encoder, text: str, persist: bool = True):
+        """
+        Encodes one text without blocking the event loop.
+        """
+        embeddings = await asyncio.wrap_future(self.submit(encoder, [text], persist))
+        return embeddings[0]
+
+    def encode_batch(self, jobs):
+        """
+        Blocking counterpart of embedding_pipeline.encode_batch, for callers on their own threads.
+
+        Args:
+            jobs (list): (key, encoder, texts) tuples.
+        Returns:
+            list: (key, embeddings) pairs in job order, with one embedding row per text.
+        """
+        futures = [(key, self.submit(encoder, texts)) for key, encoder, texts in jobs]
+        return [(key, future.result()) for key, future in futures]
+
+    def start(self):
+        """
+        Starts the pool now rather than on the first request, and waits until it is up. Process
+        workers load the models as they start, so calling this early doubles as warming them up.
+        """
+        with self._condition:
+            self._start()
+            self._condition.wait_for(lambda: self._pool is not None or self._dispatcher is None)
+
+    def close(self):
+        """
+        Finishes the queued requests and shuts the pool down.
+        """
+        with self._condition:
+            dispatcher = self._dispatcher
+            if dispatcher is None:
+                return
+            self._closing = True
+            self._condition.notify_all()
+        dispatcher.join()
+        with self._condition:
+            self._dispatcher = None
+
+    def _start(self):
+        # Called with the condition held, so it only starts the thread, the pool is started by the thread itself
+        if self._dispatcher is not None:
+            return
+        self._closing = False
+        self._dispatcher = threading.Thread(target=self._run, name="inference-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def _run(self):
+        try:
+            pool = self._open_pool()
+        except Exception as error:
+            logger.error("Failed to start the inference workers: %s", error)
+            with self._condition:
+                failed, self._queue = self._queue, deque()
+                self._dispatcher = None  # The next request tries again
+                self._condition.notify_all()
+            for _, _, _, future in failed:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(error)
+            return
+        with self._condition:
+            self._pool = pool
+            self._condition.notify_all()
+        try:
+            self._dispatch()
+        finally:
+            # Batches already handed out finish first
+            pool.shutdown()
+            with self._condition:
+                self._pool = None
+                self._condition.notify_all()
+
+    def _open_pool(self):
+        if self.kind == "thread":
+            return ThreadPoolExecutor(self.workers, thread_name_prefix="inference-worker")
+        leave_main_alone()
+        pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=load_worker_models)
+        # Workers start as tasks arrive, one per task while none is idle. Requests wait in the queue
+        # until every worker has loaded the models
+        for future in [pool.submit(int) for _ in range(self.workers)]:
+            future.result()
+        return pool
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: (self._queue and self._busy < self.workers) or (self._closing and not self._queue))
+                if not self._queue:
+                    return
+                # Merge the oldest request with every waiting request for the same encoder and persist flag
+                encoder, persist = self._queue[0][0], self._queue[0][2]
+                requests, texts, rest = [], 0, deque()
+                while self._queue:
+                    request = self._queue.popleft()
+                    if request[0] is encoder and request[2] == persist and (not requests or texts + len(request[1]) <= self.max_batch_texts):
+                        requests.append(request)
+                        texts += len(request[1])
+                    else:
+                        rest.append(request)
+                self._queue = rest
+                # Requests whose caller gave up are dropped, the rest can no longer be cancelled
+                requests = [request for request in requests if request[3].set_running_or_notify_cancel()]
+                if not requests:
+                    continue
+                self._busy += 1
+
+            batch = [text for _, request_texts, _, _ in requests for text in request_texts]
+            if self.kind == "thread":
+                future = self._pool.submit(encoder.encode, batch, persist=persist)
+            else:
+                future = self._pool.submit(encode_in_worker, encoder.model_name, batch, persist)
+            future.add_done_callback(lambda future, requests=requests: self._finish(requests, future))
+
+    def _finish(self, requests, future):
+        error = future.exception()
+        if error is None:
+            embeddings = future.result()
+            offset = 0
+            for _, texts, _, request_future in requests:
+                request_future.set_result(embeddings[offset:offset + len(texts)])
+                offset += len(texts)
+        else:
+            logger.error("Failed to encode a batch of %d requests: %s", len(requests), error)
+            for _, _, _, request_future in requests:
+                request_future.set_exception(error)
+        with self._condition:
+            self._busy -= 1
+            if error is None:
+                self.batches += 1
+                self.texts_encoded += offset
+            self._condition.notify_all()
+
+
+def leave_main_alone():
+    """
+    Keeps spawned workers from running the parent's main script. Spawn runs it again in every new
+    process, and for the server that is all of main.py's startup: loading the store, replaying the
+    journal and starting threads. Spawn skips a main module whose spec is named "__main__", as
+    it does for a package's __main__.py, so the script gets such a spec. The workers only need
+    inference_worker.
+    """
+    main_module = sys.modules["__main__"]
+    if getattr(main_module.__spec__, "name", None) != "__main__":
+        main_module.__spec__ = ModuleSpec("__main__", None, origin=getattr(main_module, "__file__", None))
@@ -0,0 +1,24 @@
+from embedding_cache import EmbeddingCache
+
+# What the inference worker processes run. They are spawned and import only this module and
+# models.py, never the server, so they start without its threads, locks and open files.
+
+# The models of this worker process, by model name
+worker_encoders = {}
+
+
+def load_worker_models():
+    """
+    Initializer of the process workers: loads both models once, each with its own embedding cache connection.
+    """
+    import models
+    from models import CachedEncoder
+    cache = EmbeddingCache(models.EMBEDDING_CACHE_FILE, models.EMBEDDING_CACHE_SIZE, models.EMBEDDING_CACHE_DISK_SIZE)
+    for model_name in (models.qa_model.model_name, models.similarity_model.model_name):
+        encoder = CachedEncoder(model_name, cache)
+        encoder.model
+        worker_encoders[model_name] = encoder
+
+
+def encode_in_worker(model_name: str, texts: list[str], persist: bool = True):
+    return worker_encoders[model_name].encode(texts, persist=persist)
@@ -0,0 +1,132 @@
+import math
+import re
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Words common enough that their postings would be scanned on nearly every query for no benefit
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have he her his i in is it its me my of on or our "
+    "she so that the their them then there they this to was we were what when where which who will "
+    "with you your".split()
+)
+
+
+def tokenize(text: str):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class InvertedIndex:
+    """
+    Incrementally maintained BM25 index.
+
+    Postings map each term to the documents containing it and the term frequency there. Removing
+    a document needs its text again, so callers pass the same text to `remove` that they passed
+    to `add` instead of the index keeping a copy of every document's terms.
+
+    Copies share the per-term posting dicts with the original, which copies a term's dict the
+    first time it changes that term afterwards. Copying costs one pointer per term and document
+    rather than one per posting.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.clear()
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def clear(self):
+        self.postings = {}  # term -> {doc id: term frequency}
+        self.doc_lengths = {}
+        self.total_length = 0
+        self._owned = set()  # Terms whose posting dicts no copy shares, so they can change in place
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["_owned"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._owned = set(self.postings)
+
+    def add(self, doc_id, text: str):
+        tokens = tokenize(text)
+        for term, frequency in Counter(tokens).items():
+            self._writable(term)[doc_id] = frequency
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def remove(self, doc_id, text: str):
+        if doc_id not in self.doc_lengths:
+            return
+        for term in set(tokenize(text)):
+            if term in self.postings:
+                docs = self._writable(term)
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[term]
+                    self._owned.discard(term)
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def search(self, query: str, k: int):
+        """
+        Ranks documents against the query with BM25.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of results to return.
+        Returns:
+            tuple: The (doc id, score) pairs of the k best documents, best first, and the total
+                number of documents that contain at least one query term.
+        """
+        if not self.doc_lengths:
+            return [], 0
+        doc_count = len(self.doc_lengths)
+        average_length = self.total_length / doc_count or 1
+        scores = Counter()
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, frequency in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores.most_common(k), len(scores)
+
+    def copy(self):
+        """
+        Returns a copy that can be pickled while the original keeps changing. The copy must not
+        be changed itself, it shares its posting dicts.
+        """
+        copied = InvertedIndex(self.k1, self.b)
+        copied.postings = self.postings.copy()
+        copied.doc_lengths = self.doc_lengths.copy()
+        copied.total_length = self.total_length
+        self._owned = set()
+        return copied
+
+    def _writable(self, term: str):
+        """
+        The posting dict of a term, copied first if a copy of the index still shares it.
+        """
+        if term not in self._owned:
+            self.postings[term] = dict(self.postings.get(term, ()))
+            self._owned.add(term)
+        return self.postings[term]
+
+
+def reciprocal_rank_fusion(*rankings, k: int = 60):
+    """
+    Fuses several rankings of (key, score) pairs by summing 1 / (k + rank) across them.
+
+    Returns:
+        list: Keys ordered by fused score, best first.
+    """
+    fused = Counter()
+    for ranking in rankings:
+        for rank, (key, _) in enumerate(ranking):
+            fused[key] += 1 / (k + rank + 1)
+    return [key for key, _ in fused.most_common()]
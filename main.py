@@ -1,35 +1,439 @@
 import time
+import asyncio
+startup_started = time.perf_counter()  # Taken before the heavier imports so they show up in the startup report
 import os
+import glob
+import bisect
+import heapq
+import itertools
+import logging
 import threading
-import pickle
+from contextlib import asynccontextmanager
+from typing_extensions import TypedDict  # pydantic needs this one to build tool schemas on Python < 3.12
 from mcp.server.fastmcp import FastMCP
-from models import similarity_model, qa_model, Memory, Topic
+from models import embedding_cache, similarity_model, qa_model, Memory, Topic, warm_up_models, chunk_text, encode_json
+from embedding_pipeline import EmbeddingPipeline
+from inference import InferenceExecutor
+from persistence import Journal, read_snapshot, write_snapshot
+from sqlite_store import SQLiteStore
+from vector_index import EmbeddingMatrix
+from vector_store import MappedVectors
+from ann_index import HNSWIndex
+from lexical_index import InvertedIndex, reciprocal_rank_fusion
+from metrics import Metrics
+from query_cache import QueryCache
+
+@asynccontextmanager
+async def crystallizer_lifespan(server):
+    """
+    Runs the periodic crystallizer for as long as the server is up and flushes on the way out.
+    The models are warmed up in the background, tools that do not embed anything are served right away.
+    """
+    if INFERENCE_EXECUTOR == "process":
+        # The worker processes load their own models, this one never needs them
+        threading.Thread(target=inference.start, name="model-warm-up", daemon=True).start()
+    else:
+        warm_up_models()
+    logger.info("Serving after %.2fs", time.perf_counter() - startup_started)
+    crystallizer = threading.Thread(target=periodic_crystallize_task, name="crystallizer", daemon=True)
+    crystallizer.start()
+    if METRICS_LOG_INTERVAL:
+        threading.Thread(target=periodic_metrics_log_task, name="metrics-log", daemon=True).start()
+    try:
+        yield
+    finally:
+        # Encode whatever is still queued first, so the final flush includes its embeddings
+        embedding_pipeline.close()
+        inference.close()
+        stop_periodic_crystallize.set()
+        crystallize_requested.set()
+        crystallizer.join()
+        journal.close()
+        if store is not None:
+            store.close()
+        embedding_cache.close()
 
 # Create an MCP server
-mcp = FastMCP("Pensieve")
-
-# Load existing memories and topics if available
-if os.path.exists("pensieve_memories.pkl"):
-    with open("pensieve_memories.pkl", "rb") as f:
-        data = pickle.load(f)
-        memories = data.get("memories", {})
-        topics = data.get("topics", {})
-else:
-    memories = {}
-    topics = {}
+mcp = FastMCP("Pensieve", lifespan=crystallizer_lifespan)
+logger = logging.getLogger("pensieve")
+# Latency of every tool and of the phases inside the slow ones, served by the metrics:// resource
+metrics = Metrics()
+imports_done = time.perf_counter()
+
+# Mutations are appended to the journal, crystalizing folds it into the snapshot
+PENSIEVE_FILE = "pensieve_memories.pkl"
+PENSIEVE_LOG = "pensieve_memories.log"
+PENSIEVE_INDEX = "pensieve_memories.hnsw"
+PENSIEVE_LEXICAL = "pensieve_memories.lexical"
+PENSIEVE_VECTORS = "pensieve_vectors"  # Embeddings are kept out of the snapshot, in memory-mapped files with this prefix
+PENSIEVE_DB = "pensieve_memories.sqlite"
+# "journal" keeps the snapshot and journal files above, "sqlite" keeps everything in PENSIEVE_DB,
+# which several server processes can share
+STORAGE_BACKEND = "journal"
+journal = Journal(PENSIEVE_FILE, PENSIEVE_LOG)
+store = SQLiteStore(PENSIEVE_DB) if STORAGE_BACKEND == "sqlite" else None
+
+memories = {}
+topics = {}
+# Memory ids are handed out in increasing order and never reused, the counter is saved with the snapshot
+next_memory_id = 1
 
 # Some hyperparameters
 MAX_MEMORIES = 10
 MAX_TOPICS = 2
-MAX_UNSAVED_MEMORIES = 5
+# Every record is durable in the journal as soon as it is written, the snapshot only bounds how much
+# startup replays. Saving rewrites the whole store while replaying a record costs about as much as
+# applying it did, so a save is only worth it once this many memories were written or deleted.
+MAX_UNSAVED_MEMORIES = 1000
 CRYSTALLIZE_INTERVAL = 60  # Seconds (1 minute)
+MEMORY_INDEX = "exact"  # "exact" scans every title and chunk embedding, "hnsw" answers both from approximate graph indexes
+HNSW_EF_SEARCH = 64  # Candidates kept per HNSW query, higher means better recall and slower queries
+VECTOR_QUANTIZATION = "float16"  # How embeddings are stored on disk: "float32", "float16" or "int8"
+HYBRID_CANDIDATES = 100  # Results taken from each of the lexical and title rankings before fusing them
+HYBRID_PRUNE = True  # Rank only the lexical matches' titles semantically when they are few enough to all be candidates
+CHUNK_CANDIDATES = 200  # Best-scoring text chunks searched for across every memory, so a memory can be found by its text alone
+ASYNC_EMBEDDING = True  # Return from writes before the new memories are encoded, a background worker embeds them
+EMBEDDING_WORKERS = 1  # Background encoding threads, the models already use several cores per call
+EMBEDDING_WAIT_TIMEOUT = 30  # Seconds a query waits for pending embeddings before searching without them
+METRICS_LOG_INTERVAL = 0  # Seconds between metrics summaries in the log, 0 turns them off
+MEMORY_PAGE_SIZE = 200  # Memories per page of the memory:// resource
+SUMMARY_TOP_TOPICS = 10  # Largest topics listed by the summary:// resource
+INFERENCE_EXECUTOR = "thread"  # "thread" encodes on threads of this process, "process" on worker processes that each load the models
+INFERENCE_WORKERS = 1  # Encode calls run at once. One thread already keeps every core busy through torch, processes need one each
+INFERENCE_BATCH_TEXTS = 64  # Most texts merged into one encode call, bounds how long a query waits behind background encoding
+QUERY_CACHE_SIZE = 256  # Results of get_memories and get_topic_timeline kept until the store changes, 0 turns the cache off
+
+# Title embeddings of every memory, kept in sync by the apply_* functions below. This is where
+# embeddings live once a memory is written, the Memory objects themselves drop theirs.
+memory_vectors = EmbeddingMatrix()
+# What get_memories searches: the vectors themselves, or a graph index built over them
+memory_index = HNSWIndex(ef_search=HNSW_EF_SEARCH) if MEMORY_INDEX == "hnsw" else memory_vectors
+# Topic name embeddings keyed by lowercase topic name, so similar topics are found with one matrix product
+topic_index = EmbeddingMatrix()
+# Embeddings of every memory's text chunks, keyed by (memory id, chunk number)
+chunk_vectors = EmbeddingMatrix()
+# What get_memories searches for the best chunks, like memory_index for the titles
+chunk_index = HNSWIndex(ef_search=HNSW_EF_SEARCH) if MEMORY_INDEX == "hnsw" else chunk_vectors
+# BM25 over the title, text and topics of every memory
+lexical_index = InvertedIndex()
+# (time, memory id) pairs of every memory, kept sorted so time windows are found by bisection
+memory_timeline = []
+# (-number of memories, topic key) of every topic, kept sorted so the largest topics come first
+topic_ranking = []
 
 # Flag to control the periodic crystallization
 stop_periodic_crystallize = threading.Event()
+# Wakes the crystallizer early once MAX_UNSAVED_MEMORIES writes and deletes have piled up
+crystallize_requested = threading.Event()
+
+# Guards the state against the crystallizer thread, which only ever holds it long enough to take a snapshot
+store_lock = threading.RLock()
+# Only one crystallization may write the snapshot at a time
+crystallize_lock = threading.Lock()
+# Journal records that have not been folded into the snapshot yet, and how many of them wrote or deleted memories
+unsaved_changes = 0
+unsaved_memories = 0
+# Memory ids and topic keys changed since the last snapshot was captured, only these are copied for the next one
+dirty_memories = set()
+dirty_topics = set()
+# The memories and topic shells of the last snapshot. Only the crystallizer touches them, under crystallize_lock
+saved_memories = {}
+saved_topics = {}
+# The full states of the HNSW graphs in the last snapshot, by part of the index file, kept the same way
+saved_graphs = {}
+# Memory ids and topic keys that are written but not embedded yet
+pending_memories = set()
+pending_topics = set()
+# Notified whenever pending embeddings are indexed or given up on
+embeddings_ready = threading.Condition(store_lock)
+# Recent query results, dropped by every applied record
+query_cache = QueryCache(QUERY_CACHE_SIZE)
+
+# Applying journal records to the in-memory state. These are shared by the tools and by startup replay.
+def memory_topic_keys(memory: Memory):
+    """
+    The memory -> topic side of the index: the lowercase keys of the topics a memory belongs to.
+    """
+    return {topic_name.lower() for topic_name in memory.topics}
+
+def memory_document(memory: Memory):
+    """
+    The text the lexical index sees for a memory.
+    """
+    return " ".join([memory.title, memory.text, *memory.topics])
+
+def apply_write(memory: Memory, new_topics: dict):
+    global next_memory_id
+    memories[memory.id] = memory
+    mark_dirty([memory.id])
+    next_memory_id = max(next_memory_id, memory.id + 1)  # Replay moves the counter past every journaled id
+    lexical_index.add(memory.id, memory_document(memory))
+    # Older journals carry the embeddings inside the write record, newer ones follow it with an embed record
+    if memory.title_embedding is not None:
+        # Memories journaled before text chunks were embedded have no chunk embeddings
+        apply_embed_memory(memory.id, memory.title_embedding, getattr(memory, "chunk_embeddings", None))
+    else:
+        pending_memories.add(memory.id)
+    memory.title_embedding = None  # The vector stores own the embeddings from here on
+    memory.chunk_embeddings = None
+    bisect.insort(memory_timeline, (memory.time, memory.id))
+    for topic_name in memory.topics:
+        topic_lower = topic_name.lower()
+        if topic_lower in topics:
+            continue
+        if topic_lower not in new_topics:
+            # Another process sharing the SQLite store pruned it after this write was prepared, or an
+            # older journal recorded the write without it. It is created again and queued for encoding.
+            new_topics[topic_lower] = Topic(topic_name)
+        topic = new_topics[topic_lower]
+        topics[topic_lower] = topic
+        mark_dirty(topic_keys=[topic_lower])
+        if topic.embedding is not None:
+            apply_embed_topic(topic_lower, topic.embedding)
+        else:
+            pending_topics.add(topic_lower)
+        topic.embedding = None
+    for topic_lower in memory_topic_keys(memory):
+        topic = topics[topic_lower]
+        size = len(topic.memories)
+        topic.add_memory(memory.id, memory.time)
+        rerank_topic(topic_lower, size, len(topic.memories))
+
+def apply_embed_memory(memory_id: int, title_embedding, chunk_embeddings):
+    # The memory may have been deleted while it was waiting to be encoded
+    if memory_id not in memories:
+        return
+    memory_vectors.add(memory_id, title_embedding)
+    if memory_index is not memory_vectors:
+        memory_index.add(memory_id, title_embedding)
+    if chunk_embeddings is not None and len(chunk_embeddings):
+        chunk_keys = [(memory_id, i) for i in range(len(chunk_embeddings))]
+        chunk_vectors.extend(chunk_keys, chunk_embeddings)
+        if chunk_index is not chunk_vectors:
+            chunk_index.extend(chunk_keys, chunk_embeddings)
+    pending_memories.discard(memory_id)
+    embeddings_ready.notify_all()
+
+def apply_embed_topic(topic_lower: str, embedding):
+    if topic_lower not in topics:
+        return
+    topic_index.add(topic_lower, embedding)
+    pending_topics.discard(topic_lower)
+    embeddings_ready.notify_all()
+
+def apply_delete(memory_id: int):
+    memory = memories.pop(memory_id, None)
+    if memory is None:
+        return  # Already deleted by another process sharing the store
+    mark_dirty([memory_id])
+    lexical_index.remove(memory_id, memory_document(memory))
+    memory_vectors.remove(memory_id)
+    if memory_index is not memory_vectors:
+        memory_index.remove(memory_id)
+    for chunk_key in memory_chunk_keys(memory_id):
+        chunk_vectors.remove(chunk_key)
+        if chunk_index is not chunk_vectors:
+            chunk_index.remove(chunk_key)
+    pending_memories.discard(memory_id)
+    del memory_timeline[bisect.bisect_left(memory_timeline, (memory.time, memory_id))]
+    # Only the memory's own topics need touching, and they are pruned as soon as they run empty
+    for topic_lower in memory_topic_keys(memory):
+        topic = topics[topic_lower]
+        size = len(topic.memories)
+        topic.remove_memory(memory_id, memory.time)
+        rerank_topic(topic_lower, size, len(topic.memories))
+        if not topic.memories:
+            del topics[topic_lower]
+            mark_dirty(topic_keys=[topic_lower])
+            topic_index.remove(topic_lower)
+            pending_topics.discard(topic_lower)
+    embeddings_ready.notify_all()
+
+def mark_dirty(memory_ids=(), topic_keys=()):
+    """
+    Notes what the next snapshot has to pick up. The SQLite store is always current and needs no snapshot.
+    """
+    if store is None:
+        dirty_memories.update(memory_ids)
+        dirty_topics.update(topic_keys)
+
+def rerank_topic(topic_lower: str, old_size: int, new_size: int):
+    """
+    Moves a topic to its new place in topic_ranking, or out of it once it is empty.
+    """
+    if old_size == new_size:
+        return
+    if old_size:
+        del topic_ranking[bisect.bisect_left(topic_ranking, (-old_size, topic_lower))]
+    if new_size:
+        bisect.insort(topic_ranking, (-new_size, topic_lower))
+
+def memory_chunk_keys(memory_id: int):
+    """
+    The keys of a memory's chunks in chunk_vectors. Chunks are numbered from 0 without gaps.
+    """
+    keys = []
+    while (memory_id, len(keys)) in chunk_vectors:
+        keys.append((memory_id, len(keys)))
+    return keys
+
+def apply_clear():
+    mark_dirty(memories, topics)
+    memories.clear()
+    topics.clear()
+    lexical_index.clear()
+    memory_vectors.clear()
+    if memory_index is not memory_vectors:
+        memory_index.clear()
+    chunk_vectors.clear()
+    if chunk_index is not chunk_vectors:
+        chunk_index.clear()
+    topic_index.clear()
+    memory_timeline.clear()
+    topic_ranking.clear()
+    pending_memories.clear()
+    pending_topics.clear()
+    embeddings_ready.notify_all()
+
+def apply_record(record: tuple):
+    operation, *args = record
+    query_cache.invalidate()
+    if operation == "write":
+        apply_write(*args)
+    elif operation == "embed_memory":
+        apply_embed_memory(*args)
+    elif operation == "embed_topic":
+        apply_embed_topic(*args)
+    elif operation == "delete":
+        apply_delete(*args)
+    elif operation == "clear":
+        apply_clear()
+
+def commit(*records: tuple):
+    """
+    Journals the records and applies them to the in-memory state.
+
+    Returns:
+        tuple: The records as committed, with the topics each write creates worked out again under store_lock.
+    """
+    global unsaved_changes, unsaved_memories
+    with store_lock, metrics.timer("commit"):
+        records = claim_new_topics(records)
+        if store is not None:
+            # Whatever other processes wrote first has to be applied before these records
+            apply_changes(store.commit(records))
+            for record in records:
+                apply_record(record)
+            return records
+        journal.append_many(records)
+        for record in records:
+            apply_record(record)
+        unsaved_changes += len(records)
+        # Embed records only follow writes, so they do not count towards an early save
+        unsaved_memories += sum(record[0] in ("write", "delete", "clear") for record in records)
+        if unsaved_memories >= MAX_UNSAVED_MEMORIES:
+            crystallize_requested.set()
+        return records
+
+def claim_new_topics(records: tuple):
+    """
+    Decides which topics each write record creates, against the state it is about to be applied to.
+    prepare_writes runs without store_lock, so a delete may prune a topic it saw, or another write
+    create one it did not, before the records get here. Call with store_lock held.
+    """
+    claimed = set()
+    result = []
+    for record in records:
+        if record[0] == "write":
+            operation, memory, prepared_topics = record
+            new_topics = {}
+            for topic_name in memory.topics:
+                topic_lower = topic_name.lower()
+                if topic_lower not in topics and topic_lower not in claimed:
+                    claimed.add(topic_lower)
+                    new_topics[topic_lower] = prepared_topics.get(topic_lower) or Topic(topic_name)
+            record = (operation, memory, new_topics)
+        result.append(record)
+    return tuple(result)
+
+def apply_changes(records: list):
+    """
+    Applies records committed by other processes sharing the SQLite store. Their embeddings are
+    encoded by the process that wrote them and arrive as records of their own, so nothing here
+    is left waiting in the pending sets.
+    """
+    for record in records:
+        apply_record(record)
+        if record[0] == "write":
+            pending_memories.discard(record[1].id)
+            pending_topics.difference_update(record[2])
+
+def sync_store():
+    """
+    Catches up on writes made by other processes before reading, when running on the SQLite store.
+    """
+    if store is not None:
+        with store_lock:
+            apply_changes(store.changes())
+
+# Encoding new memories and topics, either in the background or before the write returns
+def embedding_jobs(new_memories: list, new_topics: dict):
+    """
+    The encoding work for new memories and topics: each memory's title and text chunks, and each topic's name.
+
+    Returns:
+        list: (key, encoder, texts) jobs for the embedding pipeline.
+    """
+    jobs = [(("memory", memory.id), qa_model, [memory.title, *chunk_text(memory.text)]) for memory in new_memories]
+    jobs += [(("topic", topic_lower), similarity_model, [topic.name]) for topic_lower, topic in new_topics.items()]
+    return jobs
+
+def embed_records(results: list):
+    """
+    Turns encoded jobs into the journal records that index them.
+    """
+    records = []
+    for (kind, key), embeddings in results:
+        if kind == "memory":
+            records.append(("embed_memory", key, embeddings[0], embeddings[1:]))
+        else:
+            records.append(("embed_topic", key, embeddings[0]))
+    return records
+
+def embedding_failed(keys: list):
+    """
+    Stops queries waiting on embeddings that could not be encoded. The memories stay searchable
+    by their words, and are queued again the next time the server starts.
+    """
+    with store_lock:
+        for kind, key in keys:
+            (pending_memories if kind == "memory" else pending_topics).discard(key)
+        embeddings_ready.notify_all()
+
+def wait_for_embeddings(pending: set):
+    """
+    Blocks until everything that was in the pending set at the time of the call is embedded, or
+    EMBEDDING_WAIT_TIMEOUT passes. Writes arriving while it waits are not waited for, so a steady
+    stream of them cannot hold a read back. Call with store_lock held.
+    """
+    if pending:
+        waiting = set(pending)
+        embeddings_ready.wait_for(lambda: waiting.isdisjoint(pending), EMBEDDING_WAIT_TIMEOUT)
+
+# Every encode goes through here, so tool calls and background encoding share batches and workers
+inference = InferenceExecutor(INFERENCE_EXECUTOR, INFERENCE_WORKERS, INFERENCE_BATCH_TEXTS)
+
+embedding_pipeline = EmbeddingPipeline(
+    on_encoded=lambda results: commit(*embed_records(results)),
+    on_failed=embedding_failed,
+    workers=EMBEDDING_WORKERS,
+    encode=inference.encode_batch,
+)
 
 # implementing the resources and tools
 @mcp.tool()
-def delete_memory(memory_id: int):
+@metrics.instrument()
+async def delete_memory(memory_id: int):
     """
     Delete a memory from the Pensieve by its ID.
     
@@ -39,18 +443,22 @@ def delete_memory(memory_id: int):
     Returns:
         str: A message indicating the success or failure of the operation.
     """
-    global topics
+    return await asyncio.to_thread(remove_memory, memory_id)
+
+def remove_memory(memory_id: int):
+    """
+    The body of delete_memory. Journals under store_lock, so it runs on a worker thread.
+    """
+    sync_store()
     if memory_id in memories:
-        del memories[memory_id]
-        for topic in topics.values():
-            topic.memories.remove(memory_id)
-        topics = {name: topics[name] for name in topics if topics[name].memories}  # Remove empty topics
+        commit(("delete", memory_id))
         return f"Memory with ID {memory_id} deleted successfully."
     else:
         return f"Memory with ID {memory_id} not found."
     
 @mcp.tool()
-def update_memory(memory_id: int, title: str, time_delta: int, text: str, extracted_topics: list[str]):
+@metrics.instrument()
+async def update_memory(memory_id: int, title: str, time_delta: int, text: str, extracted_topics: list[str]):
     """
     Update an existing memory in the Pensieve.
 
@@ -63,11 +471,18 @@ def update_memory(memory_id: int, title: str, time_delta: int, text: str, extrac
     Returns:
         str: A message indicating the success or failure of the operation.
     """
-    delete_memory(memory_id)  # Delete the existing memory
-    return write_memory(title, time_delta, text, extracted_topics)  # Write the new memory
+    await delete_memory(memory_id)  # Delete the existing memory
+    return await write_memory(title, time_delta, text, extracted_topics)  # Write the new memory
+
+class NewMemory(TypedDict):
+    title: str
+    time_delta: int
+    text: str
+    extracted_topics: list[str]
 
 @mcp.tool()
-def write_memory(title : str, time_delta: int, text: str, extracted_topics: list[str]):
+@metrics.instrument()
+async def write_memory(title : str, time_delta: int, text: str, extracted_topics: list[str]):
     """
     Write a memory to the Pensieve.
 
@@ -80,71 +495,270 @@ def write_memory(title : str, time_delta: int, text: str, extracted_topics: list
     Returns:
         str: Id of the generated memory
     """
-    timestamp = time.time() - time_delta
-    memory = Memory(title, timestamp, text, extracted_topics, time.time())
-    memories[memory.id] = memory
+    memory_records = prepare_writes([NewMemory(title=title, time_delta=time_delta, text=text, extracted_topics=extracted_topics)])
 
-    for topic_name in memory.topics: # Renamed loop variable for clarity
-        topic_lower = topic_name.lower() # Use lowercase for dictionary key
-        if topic_lower not in topics: # Use lower() for case-insensitive matching
-            topics[topic_lower] = Topic(topic_name) # Store Topic object with original name
-        # Use the add_memory method of the Topic object
-        topics[topic_lower].add_memory(memory.id)
+    # Log the write before applying it, replaying the record rebuilds the same state
+    await asyncio.to_thread(commit_writes, memory_records)
 
-    return f"Memory written successfully with {memory.id}."
+    return f"Memory written successfully with {memory_records[0][1].id}."
 
 @mcp.tool()
-def crystalize_memories():
+@metrics.instrument()
+async def write_memories(new_memories: list[NewMemory]):
+    """
+    Write many memories to the Pensieve at once. Prefer this over repeated write_memory calls when importing several memories.
+
+    Args:
+        new_memories (list[dict]): The memories to write. Each one has the same fields as write_memory:
+            title, time_delta (seconds before the current time), text and extracted_topics.
+
+    Returns:
+        str: Ids of the generated memories, in the same order.
+    """
+    memory_records = prepare_writes(new_memories)
+    await asyncio.to_thread(commit_writes, memory_records)
+    return f"{len(memory_records)} memories written successfully with ids {[memory.id for _, memory, _ in memory_records]}."
+
+def prepare_writes(new_memories: list[NewMemory]):
+    """
+    Builds the journal records for a batch of new memories. Nothing is encoded here, see commit_writes.
+    The topics each record creates are only a first guess, commit settles them under store_lock.
+
+    Returns:
+        list: One ("write", memory, new_topics) record per memory, in order.
+    """
+    global next_memory_id
+    now = time.time()
+    if store is not None:
+        first_id = store.allocate_ids(len(new_memories))
+    else:
+        with store_lock:
+            first_id = next_memory_id
+            next_memory_id += len(new_memories)
+
+    # Every topic is created once, by the first memory in the batch that mentions it
+    new_topics = [{} for _ in new_memories]
+    seen_topics = set()
+    for i, new_memory in enumerate(new_memories):
+        for topic_name in new_memory["extracted_topics"]:
+            topic_lower = topic_name.lower() # Use lowercase for dictionary key
+            if topic_lower not in topics and topic_lower not in seen_topics:
+                seen_topics.add(topic_lower)
+                new_topics[i][topic_lower] = Topic(topic_name) # Store Topic object with original name
+
+    records = []
+    for memory_id, new_memory, memory_topics in zip(itertools.count(first_id), new_memories, new_topics):
+        timestamp = now - new_memory["time_delta"]
+        memory = Memory(memory_id, new_memory["title"], timestamp, new_memory["text"], new_memory["extracted_topics"], now)
+        records.append(("write", memory, memory_topics))
+    return records
+
+def commit_writes(records: list):
+    """
+    Commits write records and gets their titles, text chunks and new topics embedded. With
+    ASYNC_EMBEDDING the encoding is queued and this returns right away, otherwise every text is
+    encoded in one batch per model first. Blocks on store_lock, so async tools call it on a worker thread.
+    """
+    if ASYNC_EMBEDDING:
+        embedding_pipeline.submit(write_jobs(commit(*records)))
+    else:
+        jobs = write_jobs(records)
+        committed = commit(*records, *embed_records(inference.encode_batch(jobs)))
+        # A topic pruned by a delete while these were encoded is created again at commit, and still needs its embedding
+        encoded = {key for key, _, _ in jobs}
+        embedding_pipeline.submit([job for job in write_jobs(committed) if job[0] not in encoded])
+
+def write_jobs(records):
+    """
+    The embedding jobs of the write records among `records`.
+    """
+    writes = [record for record in records if record[0] == "write"]
+    return embedding_jobs([memory for _, memory, _ in writes], {key: topic for _, _, new_topics in writes for key, topic in new_topics.items()})
+
+@mcp.tool()
+@metrics.instrument()
+async def crystalize_memories():
     """
     Crystalizes the memories in the Pensieve into a serialized file (pensieve_memories.pkl).
+    Writes are journaled as they happen, this folds the journal into a fresh snapshot.
     
     Returns:
         str: A message indicating the success of the operation and the path to the file.
     """
-    file_path = "pensieve_memories.pkl"
-    absolute_path = os.path.abspath(file_path)
+    return await asyncio.to_thread(save_snapshot)
+
+@metrics.instrument()
+def save_snapshot():
+    """
+    Folds the journal into a fresh snapshot, for crystalize_memories, clear_memories and the
+    periodic crystallizer. Writes every file, so it never runs on the event loop.
+    """
+    global unsaved_changes, unsaved_memories
+    if store is not None:
+        # Every commit is already in the database, only the WAL is folded back
+        store.checkpoint()
+        return f"Memories crystalized successfully to {os.path.abspath(PENSIEVE_DB)}"
+    absolute_path = os.path.abspath(PENSIEVE_FILE)
     # Serialize memories and topics to a file
     try:
-        with open(file_path, "wb") as f:
-            pickle.dump({"memories": memories, "topics": topics}, f)
+        with crystallize_lock:
+            save_started = time.perf_counter()
+            # Only what changed since the last capture is copied under the lock. Memories are never
+            # mutated once written and topics are saved as shells, so both copies are cheap.
+            # The disk I/O happens after the lock is released so tool calls never wait on it.
+            with store_lock:
+                seq = journal.rotate()
+                changed_memories = {memory_id: memories.get(memory_id) for memory_id in dirty_memories}
+                changed_topics = {topic_lower: topics[topic_lower].shell() if topic_lower in topics else None for topic_lower in dirty_topics}
+                dirty_memories.clear()
+                dirty_topics.clear()
+                saved_next_memory_id = next_memory_id
+                captured_changes = unsaved_changes
+                captured_memories = unsaved_memories
+                # The mapped part of the vectors is shared, only what changed since the last save is copied
+                frozen_memory_vectors = memory_vectors.frozen()
+                frozen_topic_vectors = topic_index.frozen()
+                frozen_chunk_vectors = chunk_vectors.frozen()
+                # The exact index is cheap to rebuild at startup, the graphs are not. Only their changed nodes are copied
+                graph_changes = {"index": memory_index.snapshot(), "chunks": chunk_index.snapshot()} if isinstance(memory_index, HNSWIndex) else {}
+                lexical_state = lexical_index.copy()  # Shares the postings, each term is copied when it next changes
+            metrics.record("save_snapshot.capture", time.perf_counter() - save_started)
+
+            for saved, changed in ((saved_memories, changed_memories), (saved_topics, changed_topics)):
+                for key, value in changed.items():
+                    if value is None:
+                        saved.pop(key, None)
+                    else:
+                        saved[key] = value
+            for part, changes in graph_changes.items():
+                saved_graphs[part] = HNSWIndex.merge_snapshot(saved_graphs.get(part), changes)
+            state = {"memories": saved_memories, "topics": saved_topics, "next_memory_id": saved_next_memory_id}
+
+            # The vector files are named after the snapshot they belong to, so a crash before the
+            # snapshot is renamed into place leaves the previous snapshot and its vectors intact
+            state["vectors"] = {
+                "memories": f"{PENSIEVE_VECTORS}.{seq}.memories",
+                "topics": f"{PENSIEVE_VECTORS}.{seq}.topics",
+                "chunks": f"{PENSIEVE_VECTORS}.{seq}.chunks",
+            }
+            frozen_memory_vectors.save(state["vectors"]["memories"], VECTOR_QUANTIZATION)
+            frozen_topic_vectors.save(state["vectors"]["topics"], VECTOR_QUANTIZATION)
+            frozen_chunk_vectors.save(state["vectors"]["chunks"], VECTOR_QUANTIZATION)
+            journal.commit_snapshot(state, seq)
+            # The live vectors move onto the files just written, so the next save copies only what changes until then
+            bases = {name: MappedVectors(path) for name, path in state["vectors"].items()}
+            with store_lock:
+                memory_vectors.rebase(bases["memories"])
+                topic_index.rebase(bases["topics"])
+                chunk_vectors.rebase(bases["chunks"])
+            remove_stale_vectors(seq)
+            if graph_changes:
+                write_snapshot(PENSIEVE_INDEX, {"seq": seq, **saved_graphs})
+            write_snapshot(PENSIEVE_LEXICAL, {"seq": seq, "index": lexical_state})
+            with store_lock:
+                unsaved_changes -= captured_changes
+                unsaved_memories -= captured_memories
+            metrics.values["last_save_seconds"] = time.perf_counter() - save_started
+            metrics.values["last_save_at"] = time.time()
         return f"Memories crystalized successfully to {absolute_path}"
     except Exception as e:
         return f"Error crystalizing memories: {e}"
 
+def remove_stale_vectors(seq: int):
+    """
+    Deletes vector files that belong to snapshots older than `seq`.
+    """
+    for path in glob.glob(f"{PENSIEVE_VECTORS}.*"):
+        if not path.startswith(f"{PENSIEVE_VECTORS}.{seq}."):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # Still mapped on platforms that do not allow deleting open files, retried next time
+
 @mcp.tool()
-def clear_memories():
+@metrics.instrument()
+async def clear_memories():
     """
     Clears all memories and topics from the Pensieve.
     
     Returns:
         str: A message indicating the success of the operation.
     """
-    memories.clear()
-    topics.clear()
-    crystalize_memories()  # Save the cleared state
+    await asyncio.to_thread(clear_store)
     return "All memories cleared successfully."
 
+def clear_store():
+    commit(("clear",))
+    save_snapshot()  # Save the cleared state
+
 @mcp.tool()
-def get_memories(query: str):
+@metrics.instrument()
+async def get_memories(query: str):
     """
-    Retrieves memories relevant to the given query.
+    Retrieves memories relevant to the given query. Memories are matched both by meaning and by
+    the exact words in their title, text and topics, so rare names and terms are found too.
     
     Args:
         query (str): The query to search for.
     Returns:
-        list: A list of memories relevant to the query, with more relevant memories appearing first.
+        str: A JSON list of memories relevant to the query, with more relevant memories appearing first.
     """
-    all_memories = memories.values()
-    query_embedding = qa_model.encode(query)
+    cache_key = ("get_memories", normalize_query(query))
+    cached, _ = await asyncio.to_thread(cached_result, cache_key)
+    if cached is not None:
+        return cached
+
+    with metrics.timer("get_memories.encode"):
+        query_embedding = await inference.encode(qa_model, query, persist=False)
+    return await asyncio.to_thread(search_memories, cache_key, query, query_embedding)
+
+def search_memories(cache_key: tuple, query: str, query_embedding):
+    """
+    The ranking half of get_memories. It holds store_lock and may wait for pending embeddings,
+    so it runs on a worker thread rather than on the event loop.
+    """
+    # The embedding workers, and on the SQLite store other processes' writes, change the indexes from other threads
+    with store_lock:
+        sync_store()
+        with metrics.timer("get_memories.wait"):
+            wait_for_embeddings(pending_memories)
+        # Waiting lets go of the lock, from here on the state stays put until the result is cached
+        generation = query_cache.generation
+
+        # Rank lexically first, this is what finds rare names and terms that only appear in the text
+        with metrics.timer("get_memories.lexical"):
+            lexical_memories, lexical_matches = lexical_index.search(query, HYBRID_CANDIDATES)
+
+        with metrics.timer("get_memories.score"):
+            if HYBRID_PRUNE and MAX_MEMORIES <= lexical_matches <= HYBRID_CANDIDATES:
+                # Every memory sharing a term with the query is already a candidate, so only those titles are scored
+                semantic_memories = memory_vectors.score_keys(query_embedding, [memory_id for memory_id, score in lexical_memories])
+            else:
+                semantic_memories = memory_index.search(query_embedding, HYBRID_CANDIDATES)
+            # The best chunks across every memory, so memories whose title and words do not match the query are found by their text
+            chunk_hits = chunk_index.search(query_embedding, CHUNK_CANDIDATES)
+
+        with metrics.timer("get_memories.sort"):
+            # A memory means what the best matching of its title and text chunks means. Both come from the
+            # same model, so the scores compare directly, and a strong match in the text alone ranks
+            # as high as one in the title instead of trailing every memory that matches both a little
+            meaning_scores = dict(semantic_memories)
+            for (memory_id, _), score in chunk_hits:
+                if score > meaning_scores.get(memory_id, -1.0):
+                    meaning_scores[memory_id] = score
+            meaning_memories = sorted(meaning_scores.items(), key=lambda item: item[1], reverse=True)
 
-    # Sort memories based on cosine similarity to query
-    sorted_memories = sorted(all_memories, key=lambda m: qa_model.similarity(query_embedding, m.title_embedding), reverse=True)
+            # Fuse the rankings and return the top memories
+            top_memories = reciprocal_rank_fusion(meaning_memories, lexical_memories)[:MAX_MEMORIES]
 
-    # Return the top memories
-    return [m.dictionary() for m in sorted_memories[:MAX_MEMORIES]]
+        with metrics.timer("get_memories.serialize"):
+            result = memories_json(top_memories)
+        query_cache.put(cache_key, result, generation)
+        return result
 
 @mcp.tool()
-def get_topic_timeline(topic: str):
+@metrics.instrument()
+async def get_topic_timeline(topic: str):
     """
     Retrieves memories related to a specific topic. Memories are then sorted by time. 
     Note that the topic does not need to exactly match the topic name in the Pensieve.
@@ -153,63 +767,388 @@ def get_topic_timeline(topic: str):
     Args:
         topic (str): The name of the topic. This can be a person, place, or event.
     Returns:
-        list: A list of memories related to the topic.
+        str: A JSON list of memories related to the topic, oldest first.
     """
-    relevant_topics = get_similar_topics(topic.lower())  # Get similar topics
+    cache_key = ("get_topic_timeline", normalize_query(topic))
+    # Any change while the similar topics are looked up makes the result too old to cache
+    cached, generation = await asyncio.to_thread(cached_result, cache_key)
+    if cached is not None:
+        return cached
 
-    retrieved_memories = []
-    for topic in relevant_topics:        
-        topic_lower = topic.lower()
-        if topic_lower in topics:
-            topic_obj = topics[topic_lower]
-            memory_ids = topic_obj.memories
-            topic_memories = [memories[m_id] for m_id in memory_ids if m_id in memories]
-            retrieved_memories.extend(topic_memories)
-    retrieved_memories = sorted(retrieved_memories, key=lambda m: m.time)  # Sort by time
-    return [m.dictionary() for m in retrieved_memories]
+    relevant_topics = await get_similar_topics(topic.lower())  # Get similar topics
+    return await asyncio.to_thread(topic_timeline, cache_key, generation, relevant_topics)
+
+def topic_timeline(cache_key: tuple, generation: int, relevant_topics: list):
+    """
+    The memories of the given topics, oldest first, as a JSON list. Runs on a worker thread for get_topic_timeline.
+    """
+    with store_lock:
+        sync_store()
+        if store is not None:
+            # A range scan over the topics' rows, already merged and ordered by time
+            memory_ids = store.memory_ids_by_time(-float("inf"), float("inf"), [name.lower() for name in relevant_topics])
+            # Ids committed by other processes since the last sync are left for the next call
+            result = memories_json(memory_id for memory_id in memory_ids if memory_id in memories)
+        else:
+            # Each topic's timeline is already sorted by time, so merging them is enough
+            timelines = [topics[name.lower()].timeline for name in relevant_topics if name.lower() in topics]
+            result = memories_json(unique_memory_ids(heapq.merge(*timelines)))
+        query_cache.put(cache_key, result, generation)
+        return result
+
+@mcp.tool()
+@metrics.instrument()
+async def get_memories_between(start_delta: int, end_delta: int = 0, topic: str | None = None, limit: int = 20, offset: int = 0):
+    """
+    Retrieves memories that happened within a time window, oldest first.
+    Use this for questions like "what happened between March and May".
+
+    Args:
+        start_delta (int): The start of the window, in seconds before the current time.
+        end_delta (int): The end of the window, in seconds before the current time. 0 means now.
+        topic (str, optional): Only return memories related to this topic. As with get_topic_timeline,
+            semantic similarity is used to find the most relevant topics.
+        limit (int): The maximum number of memories to return.
+        offset (int): The number of memories in the window to skip, for fetching further pages.
+    Returns:
+        str: A JSON object with the memories in the window and the offset of the next page, which is null once the window is exhausted.
+    """
+    now = time.time()
+    start, end = sorted((now - start_delta, now - end_delta))
+    topic_keys = None if topic is None else [name.lower() for name in await get_similar_topics(topic.lower())]
+    return await asyncio.to_thread(memories_between, start, end, topic_keys, limit, offset)
+
+def memories_between(start: float, end: float, topic_keys: list | None, limit: int, offset: int):
+    """
+    A page of get_memories_between as a JSON object. Runs on a worker thread.
+    """
+    with store_lock:
+        if store is not None:
+            sync_store()
+            page = [memory_id for memory_id in store.memory_ids_by_time(start, end, topic_keys, limit + 1, offset) if memory_id in memories]
+        else:
+            page = memory_window(start, end, topic_keys, limit, offset)
+        next_offset = offset + limit if len(page) > limit else None
+        return f'{{"memories": {memories_json(page[:limit])}, "next_offset": {encode_json(next_offset)}}}'
+
+def memory_window(start: float, end: float, topic_keys: list, limit: int, offset: int):
+    """
+    The ids of up to limit + 1 memories between start and end, oldest first, found in the in-memory timelines.
+    """
+    if topic_keys is None:
+        timelines = [memory_timeline]
+    else:
+        timelines = [topics[topic_lower].timeline for topic_lower in topic_keys if topic_lower in topics]
+    # Bisect each timeline down to the window so memories outside it are never looked at
+    windows = [timeline[bisect.bisect_left(timeline, (start,)):bisect.bisect_right(timeline, (end, float("inf")))] for timeline in timelines]
+    return list(itertools.islice(unique_memory_ids(heapq.merge(*windows)), offset, offset + limit + 1))
+
+def cached_result(cache_key: tuple):
+    """
+    Looks a query up in query_cache after catching up on other processes' writes.
+
+    Returns:
+        tuple: The cached result or None, and the generation a freshly computed result would belong to.
+    """
+    with store_lock:
+        sync_store()
+        return query_cache.get(cache_key), query_cache.generation
+
+def normalize_query(query: str):
+    """
+    The cache key form of a query. Both models lowercase their input and the lexical index splits
+    on whitespace, so queries differing only in case or spacing get the same results.
+    """
+    return " ".join(query.lower().split())
+
+def memories_json(memory_ids):
+    """
+    Serializes memories to a JSON list in one string, so results never go through a dict per memory.
+    """
+    return "[" + ", ".join(memories[memory_id].json() for memory_id in memory_ids) + "]"
+
+def unique_memory_ids(timeline):
+    """
+    Yields the memory ids of a merged (time, memory id) timeline, skipping memories that appear in several topics.
+    """
+    previous = None
+    for entry in timeline:
+        if entry != previous:
+            yield entry[1]
+        previous = entry
 
 def periodic_crystallize_task():
     """
-    Periodically calls crystalize_memories.
+    Periodically calls save_snapshot. Runs every CRYSTALLIZE_INTERVAL seconds, or sooner once
+    MAX_UNSAVED_MEMORIES memories were written or deleted, and skips the save when nothing changed.
     """
     while not stop_periodic_crystallize.is_set():
-        crystalize_memories()
-        stop_periodic_crystallize.wait(CRYSTALLIZE_INTERVAL)
+        crystallize_requested.wait(CRYSTALLIZE_INTERVAL)
+        crystallize_requested.clear()
+        # On the SQLite store this checkpoints, which also prunes the changes every process has seen
+        if unsaved_changes or store is not None:
+            save_snapshot()
+
+    # Flush whatever is left before the server exits
+    if unsaved_changes:
+        save_snapshot()
 
-def get_similar_topics(topic: str):
+async def get_similar_topics(topic: str):
+    await asyncio.to_thread(sync_store)
     if not topics:
         return []
 
     # Encode the query subject
-    topic_embedding = similarity_model.encode(topic)
+    with metrics.timer("get_similar_topics.encode"):
+        topic_embedding = await inference.encode(similarity_model, topic, persist=False)
+    return await asyncio.to_thread(closest_topics, topic_embedding)
 
-    # Retrieve existing topic objects and their pre-calculated embeddings
-    existing_topic_objects = list(topics.values())
-    topic_embeddings = [topic.embedding for topic in existing_topic_objects]
-    topic_names = [topic.name for topic in existing_topic_objects] # Get original names
+def closest_topics(topic_embedding):
+    """
+    The names of the MAX_TOPICS topics closest to the embedding. Runs on a worker thread, as it may wait for pending topics.
+    """
+    # Select the MAX_TOPICS topics closest to the input topic from the maintained topic matrix
+    with store_lock:
+        wait_for_embeddings(pending_topics)
+        with metrics.timer("get_similar_topics.score"):
+            similar_topics = topic_index.search(topic_embedding, MAX_TOPICS)
 
-    # Calculate cosine similarities between topic and existing topic embeddings
-    similarities = similarity_model.similarity(topic_embedding, topic_embeddings)[0] # Get the first row
+        # Return the original names of the similar topics
+        return [topics[topic_lower].name for topic_lower, score in similar_topics if topic_lower in topics]
 
-    # Pair original topic names with their scores and sort
-    scored_topics = sorted(zip(topic_names, similarities), key=lambda item: item[1], reverse=True)
+@mcp.resource("memory:://")
+async def get_all_memory():
+    """
+    Returns the first page of memories, oldest first. Read memory:://page/{cursor} with the
+    returned next_cursor for the following pages, and summary:// for an overview.
 
-    # Return the names of the MAX_TOPICS topics that are similar to the input topic
-    return [name for name, score in scored_topics[:MAX_TOPICS]]
+    Returns:
+        dict: The "memories" on the page as id, title and time, and "next_cursor", null on the last page.
+    """
+    return await asyncio.to_thread(memory_page, None)
 
-@mcp.resource("memory:://")
-def get_all_memory():
+@mcp.resource("memory:://page/{cursor}")
+async def get_memory_page(cursor: str):
     """
-    This function returns a dictionary containing the current state of memories and topics.
-    
+    Returns the page of memories that follows `cursor`, a next_cursor from a previous page.
+
+    Returns:
+        dict: The "memories" on the page as id, title and time, and "next_cursor", null on the last page.
+    """
+    return await asyncio.to_thread(memory_page, cursor)
+
+def memory_page(cursor: str | None):
+    """
+    One page of memories after `cursor`, or the first page. Runs on a worker thread for the memory resources.
+    """
+    # The cursor is the (time, id) of the last memory on the previous page, so pages stay
+    # consistent while memories are written or deleted in between
+    with store_lock:
+        sync_store()
+        start = 0
+        if cursor is not None:
+            last_time, last_id = cursor.rsplit("-", 1)
+            start = bisect.bisect_right(memory_timeline, (float(last_time), int(last_id)))
+        page = memory_timeline[start:start + MEMORY_PAGE_SIZE]
+        return {
+            "memories": [{"id": memory_id, "title": memories[memory_id].title, "time": memory_time} for memory_time, memory_id in page],
+            "next_cursor": f"{page[-1][0]!r}-{page[-1][1]}" if start + MEMORY_PAGE_SIZE < len(memory_timeline) else None,
+        }
+
+@mcp.resource("summary://")
+async def get_summary():
+    """
+    An overview of the Pensieve that is cheap to read at any size: counts, the time span covered
+    the largest topics and when the Pensieve was last crystalized.
+
     Returns:
-        dict: A dictionary containing the current state of memories and topics.
+        dict: "memories" and "topics" counts, "oldest" and "newest" memory times, "top_topics" with
+            their sizes and "last_save_at", null before the first save of this process.
+    """
+    return await asyncio.to_thread(memory_summary)
+
+def memory_summary():
+    """
+    The body of get_summary. Runs on a worker thread, since it takes store_lock and syncs the store.
+    """
+    with store_lock:
+        sync_store()
+        return {
+            "memories": len(memories),
+            "topics": len(topics),
+            "oldest": memory_timeline[0][0] if memory_timeline else None,
+            "newest": memory_timeline[-1][0] if memory_timeline else None,
+            "top_topics": [{"name": topics[topic_lower].name, "memories": -size} for size, topic_lower in topic_ranking[:SUMMARY_TOP_TOPICS]],
+            "last_save_at": metrics.values.get("last_save_at"),
+        }
+
+@mcp.resource("metrics://")
+def get_metrics():
+    """
+    Reports where the server spends its time: call counts and latency histograms of every tool,
+    the phases inside get_memories, journal commits and snapshot saves, plus the size of the store.
+
+    Returns:
+        dict: "timings" in milliseconds, "store" sizes, "embeddings" pipeline status, "cache" and
+            "query_cache" hit counts and "saves".
     """
     return {
-        "memories": [m.title for m in memories.values()],
-        "topics": [topic.name for topic in topics.values()]
+        "timings": metrics.snapshot(),
+        "store": {
+            "memories": len(memories),
+            "topics": len(topics),
+            "memory_vectors": len(memory_vectors),
+            "chunk_vectors": len(chunk_vectors),
+            "unsaved_changes": unsaved_changes,
+            "unsaved_memories": unsaved_memories,
+        },
+        "embeddings": get_embedding_status(),
+        "cache": {"hits": qa_model.cache.hits, "misses": qa_model.cache.misses},
+        "query_cache": {"hits": query_cache.hits, "misses": query_cache.misses, "entries": len(query_cache), "generation": query_cache.generation},
+        "saves": dict(metrics.values),
     }
 
+def periodic_metrics_log_task():
+    """
+    Logs a one-line summary of the timings every METRICS_LOG_INTERVAL seconds.
+    """
+    while not stop_periodic_crystallize.wait(METRICS_LOG_INTERVAL):
+        logger.info("Metrics: %d memories, %s", len(memories), metrics.summary() or "no calls yet")
+
+@mcp.resource("status://embeddings")
+def get_embedding_status():
+    """
+    Reports the background encoding of new memories and topics.
+
+    Returns:
+        dict: The queued jobs, the memories and topics not searchable by meaning yet, and the work done so far,
+            also counted per inference batch, which includes the encodes of queries.
+    """
+    return {
+        "queue_depth": embedding_pipeline.queue_depth,
+        "pending_memories": len(pending_memories),
+        "pending_topics": len(pending_topics),
+        "batches": embedding_pipeline.batches,
+        "texts_encoded": embedding_pipeline.texts_encoded,
+        "encode_seconds": embedding_pipeline.encode_seconds,
+        "inference_batches": inference.batches,
+        "inference_texts": inference.texts_encoded,
+    }
+
+# Load existing memories and topics if available, then replay the journal tail on top
+if store is not None:
+    # The database is always current, there is no journal to replay and no index files to reuse
+    stored = store.load()
+    snapshot, records = {}, []
+    memories.update(stored["memories"])
+    topics.update(stored["topics"])
+else:
+    snapshot, records = journal.load()
+    memories.update(snapshot.get("memories", {}))
+    topics.update(snapshot.get("topics", {}))
+    # The next snapshot starts from this one, the replayed records below mark what changed since
+    saved_memories = snapshot.get("memories", {})
+    saved_topics = {topic_lower: topic.shell() for topic_lower, topic in topics.items()}
+    # Snapshots from before the counter continue after their largest id
+    next_memory_id = snapshot.get("next_memory_id", max(memories, default=0) + 1)
+snapshot_loaded = time.perf_counter()
+
+if store is not None:
+    memory_vectors.extend(*stored["memory_embeddings"])
+    chunk_vectors.extend(*stored["chunk_embeddings"])
+    topic_index.extend(*stored["topic_embeddings"])
+    del stored
+elif "vectors" in snapshot:
+    memory_vectors = EmbeddingMatrix.open(snapshot["vectors"]["memories"])
+    topic_index = EmbeddingMatrix.open(snapshot["vectors"]["topics"])
+    if "chunks" in snapshot["vectors"]:
+        chunk_vectors = EmbeddingMatrix.open(snapshot["vectors"]["chunks"])
+else:
+    # Older snapshots kept the embeddings on the Memory and Topic objects themselves
+    memory_vectors.extend(list(memories), [m.title_embedding for m in memories.values()])
+    topic_index.extend(list(topics), [t.embedding for t in topics.values()])
+    for memory in memories.values():
+        memory.title_embedding = None
+    for topic in topics.values():
+        topic.embedding = None
+
+def load_saved_index(path: str):
+    """
+    Loads the indexes saved next to the snapshot, if they match the snapshot. The journal replay below brings them up to date.
+
+    Returns:
+        dict: The saved indexes by name, "index" for the main one. Empty if there are none.
+    """
+    saved = read_snapshot(path)
+    return saved if "index" in saved and saved["seq"] == snapshot.get("seq", 0) else {}
+
+def graph_index(saved_state, vectors: EmbeddingMatrix):
+    """
+    The HNSW index saved with the snapshot, or a new one built over `vectors` when there is none.
+    """
+    if saved_state is not None:
+        index = HNSWIndex.from_snapshot(saved_state)
+        index.ef_search = HNSW_EF_SEARCH
+        return index
+    index = HNSWIndex(ef_search=HNSW_EF_SEARCH)
+    for keys, block in vectors.blocks():
+        index.extend(keys, block)
+    return index
+
+if isinstance(memory_index, HNSWIndex):
+    # The saved graphs are also what the crystallizer merges the changes of each save into.
+    # Index files from before chunks had a graph of their own only hold the memories' one
+    if store is None:
+        saved = load_saved_index(PENSIEVE_INDEX)
+        saved_graphs = {part: saved[part] for part in ("index", "chunks") if part in saved}
+        del saved
+    memory_index = graph_index(saved_graphs.get("index"), memory_vectors)
+    chunk_index = graph_index(saved_graphs.get("chunks"), chunk_vectors)
+else:
+    memory_index = memory_vectors
+    chunk_index = chunk_vectors
+
+saved_lexical_index = load_saved_index(PENSIEVE_LEXICAL).get("index") if store is None else None
+if saved_lexical_index is not None:
+    lexical_index = saved_lexical_index
+else:
+    for memory in memories.values():
+        lexical_index.add(memory.id, memory_document(memory))
+memory_timeline.extend(sorted((m.time, m.id) for m in memories.values()))
+if store is None:
+    # Snapshots keep topics as shells, their memories and timelines come from the memories' own topic lists.
+    # Walking the memories in time order leaves every timeline sorted. The SQLite store loads them ready-made.
+    for topic in topics.values():
+        topic.memories = set()
+        topic.timeline = []
+    for memory_time, memory_id in memory_timeline:
+        for topic_lower in memory_topic_keys(memories[memory_id]):
+            topic = topics.get(topic_lower)
+            if topic is not None:
+                topic.memories.add(memory_id)
+                topic.timeline.append((memory_time, memory_id))
+topic_ranking.extend(sorted((-len(topic.memories), topic_lower) for topic_lower, topic in topics.items()))
+indexes_built = time.perf_counter()
+
+with store_lock:  # Applying records notifies embeddings_ready, which needs the lock held
+    for record in records:
+        apply_record(record)
+unsaved_changes = len(records)
+unsaved_memories = sum(record[0] in ("write", "delete", "clear") for record in records)
+replay_done = time.perf_counter()
+
+# Queue anything whose encoding was lost when the server last stopped
+unembedded_memories = [memory for memory in memories.values() if memory.id not in memory_vectors]
+unembedded_topics = {topic_lower: topic for topic_lower, topic in topics.items() if topic_lower not in topic_index}
+pending_memories.update(memory.id for memory in unembedded_memories)
+pending_topics.update(unembedded_topics)
+embedding_pipeline.submit(embedding_jobs(unembedded_memories, unembedded_topics))
+
+logger.info(
+    "Startup: imports %.2fs, snapshot %.2fs (%d memories), indexes %.2fs, journal replay %.2fs (%d records)",
+    imports_done - startup_started, snapshot_loaded - imports_done, len(memories),
+    indexes_built - snapshot_loaded, replay_done - indexes_built, len(records),
+)
 
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file
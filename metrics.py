@@ -0,0 +1,112 @@
+import bisect
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in milliseconds. The last bucket catches everything slower.
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Metrics:
+    """
+    Call counts and latency histograms, cheap enough to leave on.
+
+    Recording a duration is a bisect into a fixed bucket list and a few additions under a lock,
+    so percentiles are estimated from the buckets rather than kept exactly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}  # name -> [count, total seconds, max seconds, bucket counts]
+        self.values = {}  # Gauges like the last save duration, set directly
+
+    def record(self, name: str, seconds: float):
+        bucket = bisect.bisect_left(BUCKETS_MS, seconds * 1000)
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = [0, 0.0, 0.0, [0] * (len(BUCKETS_MS) + 1)]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+            timing[3][bucket] += 1
+
+    @contextmanager
+    def timer(self, name: str):
+        """
+        Records how long the body of the with statement took, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def instrument(self, name: str = None):
+        """
+        Decorator recording every call of a function under `name`, the function's name by default.
+        The wrapper keeps the signature and docstring, so it can sit under @mcp.tool(), and
+        coroutine functions are timed until they finish rather than until they first yield.
+        """
+        def decorator(function):
+            label = name or function.__name__
+
+            if inspect.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(label):
+                        return await function(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(label):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Per timing name the call count, mean, estimated p50/p90/p99, max and the
+                histogram, all in milliseconds.
+        """
+        with self._lock:
+            timings = {name: (count, total, longest, list(buckets)) for name, (count, total, longest, buckets) in self._timings.items()}
+        report = {}
+        for name, (count, total, longest, buckets) in sorted(timings.items()):
+            report[name] = {
+                "count": count,
+                "mean_ms": round(total / count * 1000, 3),
+                "p50_ms": estimate_percentile(buckets, count, 0.5, longest),
+                "p90_ms": estimate_percentile(buckets, count, 0.9, longest),
+                "p99_ms": estimate_percentile(buckets, count, 0.99, longest),
+                "max_ms": round(longest * 1000, 3),
+                "histogram_ms": {f"<={bound}": n for bound, n in zip(BUCKETS_MS, buckets) if n}
+                | ({f">{BUCKETS_MS[-1]}": buckets[-1]} if buckets[-1] else {}),
+            }
+        return report
+
+    def summary(self):
+        """
+        One line with the count, p50 and p99 of every timing, for the periodic log.
+        """
+        return ", ".join(
+            f"{name} n={timing['count']} p50={timing['p50_ms']}ms p99={timing['p99_ms']}ms"
+            for name, timing in self.snapshot().items()
+        )
+
+
+def estimate_percentile(buckets: list, count: int, q: float, longest: float):
+    """
+    The upper bound of the bucket holding the q-th call, capped by the slowest call seen.
+    """
+    rank = q * count
+    seen = 0
+    for bound, n in zip(BUCKETS_MS, buckets):
+        seen += n
+        if seen >= rank:
+            return min(bound, round(longest * 1000, 3))
+    return round(longest * 1000, 3)
@@ -1,20 +1,187 @@
 import time as record
-import uuid
-from sentence_transformers import SentenceTransformer # Added import
+import sys
+import json
+import bisect
+import logging
+import threading
+import numpy as np
+from embedding_cache import EmbeddingCache
 
-qa_model = SentenceTransformer('multi-qa-mpnet-base-cos-v1')
-similarity_model = SentenceTransformer("all-MiniLM-L6-v2")
+logger = logging.getLogger("pensieve")
+
+# Embeddings are cached across both models and across restarts
+EMBEDDING_CACHE_FILE = "pensieve_embeddings.sqlite"
+EMBEDDING_CACHE_SIZE = 4096  # Embeddings kept in memory, the rest are read back from disk
+EMBEDDING_CACHE_DISK_SIZE = 100_000  # Embeddings kept on disk, the oldest written are dropped past this
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_FILE, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DISK_SIZE)
+
+# How the models run. "torch" is the stock fp32 model, "int8" quantizes its linear layers to int8
+# after loading, "onnx" runs an ONNX export on ONNX Runtime (needs optimum[onnxruntime]).
+# check_encoder_parity.py compares a backend against fp32 before switching.
+ENCODER_BACKEND = "torch"
+ENCODER_THREADS = 0  # Threads per inference call, 0 leaves it to the library (one per core)
+MAX_SEQ_LENGTH = 0  # Tokens read per text, longer texts are cut. 0 keeps each model's own limit
+
+# Memory text is embedded in overlapping windows of words, sized to fit the QA model's input
+CHUNK_WORDS = 120
+CHUNK_OVERLAP = 30
+
+def chunk_text(text: str, chunk_words: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP):
+    """
+    Splits text into overlapping chunks of at most `chunk_words` words.
+
+    Returns:
+        list[str]: The chunks, in order. Empty if the text has no words.
+    """
+    words = text.split()
+    if not words:
+        return []
+    # Stop before a trailing window that would only repeat the previous chunk's overlap
+    starts = range(0, max(len(words) - overlap, 1), chunk_words - overlap)
+    return [" ".join(words[start:start + chunk_words]) for start in starts]
+
+# encode arguments that only change how the work is done, not the embeddings
+NEUTRAL_ENCODE_ARGS = frozenset({"batch_size", "show_progress_bar"})
+# encode arguments that change the type of what comes back, the cache only holds float32 arrays
+UNCACHEABLE_ENCODE_ARGS = frozenset({"convert_to_tensor", "convert_to_numpy", "output_value", "precision"})
+
+class CachedEncoder:
+    """
+    Wraps a SentenceTransformer so `encode` only runs the model on text it has not seen before.
+    Everything else is passed through to the wrapped model.
+
+    The model itself is loaded on first use (or by `warm_up_models`), so importing this module
+    does not pay for torch and the model weights.
+    """
+    def __init__(self, model_name: str, cache: EmbeddingCache, backend: str = ENCODER_BACKEND, max_seq_length: int = MAX_SEQ_LENGTH):
+        self.model_name = model_name
+        self.cache = cache
+        self.backend = backend
+        self.max_seq_length = max_seq_length
+        # Other backends and truncations give slightly different embeddings, so they are cached apart from fp32
+        self.cache_name = model_name if backend == "torch" and not max_seq_length else f"{model_name}:{backend}:{max_seq_length}"
+        self.load_time = None  # Seconds it took to load the model, once loaded
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    start = record.perf_counter()
+                    self._model = load_sentence_transformer(self.model_name, self.backend, self.max_seq_length)
+                    self.load_time = record.perf_counter() - start
+                    logger.info("Loaded %s (%s) in %.2fs", self.model_name, self.backend, self.load_time)
+        return self._model
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def encode(self, sentences, persist: bool = True, **kwargs):
+        # persist=False keeps the embeddings out of the cache file, for texts unlikely to come back like queries
+        unsupported = UNCACHEABLE_ENCODE_ARGS.intersection(kwargs)
+        if unsupported:
+            raise ValueError(f"CachedEncoder only returns float32 arrays, call .model.encode directly for {sorted(unsupported)}")
+        # Arguments like normalize_embeddings or prompt change the embeddings, so they are cached apart
+        options = sorted((name, value) for name, value in kwargs.items() if name not in NEUTRAL_ENCODE_ARGS)
+        cache_name = f"{self.cache_name}:{options!r}" if options else self.cache_name
+
+        texts = [sentences] if isinstance(sentences, str) else list(sentences)
+        embeddings = self.cache.get_many(cache_name, texts)
+
+        missing = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing:
+            encoded = self.model.encode(missing, **kwargs)
+            self.cache.put_many(cache_name, missing, encoded, persist)
+            fresh = dict(zip(missing, encoded))
+            embeddings = [fresh[text] if embedding is None else embedding for text, embedding in zip(texts, embeddings)]
+
+        if isinstance(sentences, str):
+            return embeddings[0]
+        if not embeddings:
+            return np.empty((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.stack(embeddings)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+def load_sentence_transformer(model_name: str, backend: str = "torch", max_seq_length: int = 0, threads: int = ENCODER_THREADS):
+    """
+    Loads a SentenceTransformer for CPU inference with the given backend.
+
+    Args:
+        model_name (str): The model to load.
+        backend (str): "torch", "int8" or "onnx", see ENCODER_BACKEND.
+        max_seq_length (int): Tokens read per text, 0 keeps the model's own limit.
+        threads (int): Threads per inference call, 0 leaves it to the library.
+    """
+    # Both pull in torch, so only import them when needed
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "onnx":
+        import onnxruntime
+        session_options = onnxruntime.SessionOptions()
+        if threads:
+            session_options.intra_op_num_threads = threads
+        model = SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs={"session_options": session_options})
+    elif backend in ("torch", "int8"):
+        if threads:
+            torch.set_num_threads(threads)  # Applies to the whole process, both models share the setting
+        # Dynamic quantization only runs on the CPU, fp32 still picks up a GPU if there is one
+        model = SentenceTransformer(model_name, device="cpu" if backend == "int8" else None)
+        if backend == "int8":
+            # Weights of the linear layers become int8, activations are quantized on the fly per batch
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    else:
+        raise ValueError(f"Unknown encoder backend {backend!r}")
+
+    if max_seq_length:
+        model.max_seq_length = max_seq_length
+    return model
+
+qa_model = CachedEncoder('multi-qa-mpnet-base-cos-v1', embedding_cache)
+similarity_model = CachedEncoder("all-MiniLM-L6-v2", embedding_cache)
+
+def warm_up_models():
+    """
+    Loads both models on a background thread so the first embedding request does not wait for them.
+
+    Returns:
+        threading.Thread: The loading thread.
+    """
+    def load():
+        for encoder in (qa_model, similarity_model):
+            try:
+                encoder.model
+            except Exception:
+                logger.exception("Failed to load %s", encoder.model_name)
+
+    thread = threading.Thread(target=load, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+# Serializes strings, numbers and lists straight to JSON text
+encode_json = json.JSONEncoder(ensure_ascii=False).encode
 
 class Memory:
-    def __init__(self, title: str, time: int, text: str, topics: list[str], insert_time):
-        self.id = id(uuid.uuid4())
+    # Slots instead of a __dict__ per memory, which adds up at a million memories
+    __slots__ = ("id", "title", "time", "insert_time", "text", "topics", "title_embedding", "chunk_embeddings")
+
+    def __init__(self, memory_id: int, title: str, time: int, text: str, topics: list[str], insert_time, title_embedding=None, chunk_embeddings=None):
+        self.id = memory_id
         self.title = title
         self.time = time
         self.insert_time = insert_time
         self.text = text
-        self.topics = topics
-        # Generate and store the title embedding
-        self.title_embedding = qa_model.encode(title)
+        # The same few topic names repeat across many memories, so they share one string each
+        self.topics = tuple(sys.intern(topic) for topic in topics)
+        # Embeddings are encoded in batches by the writer, or later by the embedding pipeline
+        self.title_embedding = title_embedding
+        # One embedding per chunk of the text, in chunk_text order
+        self.chunk_embeddings = chunk_embeddings
 
     def dictionary(self):
         return {
@@ -23,14 +190,66 @@ class Memory:
             "time": self.time,
             "insert_time": self.insert_time,
             "text": self.text,
-            "topics": self.topics,
+            "topics": list(self.topics),
         }
 
+    def json(self):
+        """
+        The same fields as `dictionary`, written directly as JSON text without building the dict.
+        """
+        return (
+            f'{{"id": {self.id}, "title": {encode_json(self.title)}, "time": {encode_json(self.time)}, '
+            f'"insert_time": {encode_json(self.insert_time)}, "text": {encode_json(self.text)}, '
+            f'"topics": {encode_json(list(self.topics))}}}'
+        )
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        # Memories pickled before __slots__ carry their __dict__, possibly without the newer fields
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        self.title_embedding = None
+        self.chunk_embeddings = None
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.topics = tuple(sys.intern(topic) for topic in self.topics)
+
 class Topic:
-    def __init__(self, name: str):
-        self.name = name
-        self.embedding = similarity_model.encode(name)
-        self.memories = []
+    def __init__(self, name: str, embedding=None):
+        self.name = sys.intern(name)
+        self.embedding = embedding  # Encoded in batches by the writer, or later by the embedding pipeline
+        self.memories = set()
+        self.timeline = []  # (time, memory id) pairs of the same memories, kept sorted
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.name = sys.intern(self.name)
+        self.memories = set(self.memories)  # Older snapshots stored a list, possibly with duplicates
+        if "timeline" not in state:
+            self.timeline = None  # Older snapshots have no timeline, it is rebuilt from the memories on load
+
+    def shell(self):
+        """
+        The topic without its memories, as snapshots store it. The memories are rebuilt from the
+        memories' own topics on load, so saving a topic never copies its members.
+        """
+        return Topic(self.name)
+
+    def copy(self):
+        topic = Topic(self.name, self.embedding)
+        topic.memories = set(self.memories)
+        topic.timeline = list(self.timeline)
+        return topic
+
+    def add_memory(self, memory_id: int, memory_time: float):
+        if memory_id not in self.memories:
+            self.memories.add(memory_id)
+            bisect.insort(self.timeline, (memory_time, memory_id))
 
-    def add_memory(self, memory_id: str):
-        self.memories.append(memory_id)
\ No newline at end of file
+    def remove_memory(self, memory_id: int, memory_time: float):
+        if memory_id in self.memories:
+            self.memories.remove(memory_id)
+            i = bisect.bisect_left(self.timeline, (memory_time, memory_id))
+            del self.timeline[i]
\ No newline at end of file
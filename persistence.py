@@ -0,0 +1,167 @@
+import os
+import pickle
+import shutil
+import struct
+import zlib
+
+# Every journal record is framed as <length, crc32> followed by the pickled payload
+FRAME_HEADER = struct.Struct("<II")
+
+
+class Journal:
+    """
+    Append-only write-ahead log paired with a snapshot file.
+
+    Mutations are appended to the log as small records, so the cost of saving scales with the
+    number of changes rather than the size of the store. Compaction is split in two so the
+    slow part can run without holding up writers: `rotate` moves the log aside while the caller
+    captures its state, then `commit_snapshot` writes that state and drops the old log segment.
+    Every record carries a sequence number and the snapshot remembers the last one it contains,
+    so a crash part-way through compaction never replays a record twice.
+    """
+
+    def __init__(self, snapshot_path: str, log_path: str, sync: bool = True):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.old_log_path = log_path + ".old"
+        self.sync = sync
+        self.seq = 0
+        self._log = None
+
+    def load(self):
+        """
+        Reads the snapshot and the log tail that has not been folded into it yet.
+
+        Returns:
+            tuple: The snapshot dictionary (empty if there is none) and the list of records to replay, in order.
+        """
+        snapshot = read_snapshot(self.snapshot_path)
+        self.seq = snapshot.get("seq", 0)
+
+        records = []
+        for seq, record in [*self._read_log(self.old_log_path), *self._read_log(self.log_path)]:
+            if seq > self.seq:
+                records.append(record)
+                self.seq = seq
+        return snapshot, records
+
+    def append(self, record):
+        """
+        Appends a record to the log and syncs it to disk.
+
+        Args:
+            record (tuple): The record to append. The first element names the operation.
+        """
+        self.append_many([record])
+
+    def append_many(self, records):
+        """
+        Appends several records to the log with a single sync.
+
+        Args:
+            records (list[tuple]): The records to append, in order.
+        """
+        frames = []
+        for record in records:
+            self.seq += 1
+            payload = pickle.dumps((self.seq, record), protocol=pickle.HIGHEST_PROTOCOL)
+            frames.append(FRAME_HEADER.pack(len(payload), zlib.crc32(payload)))
+            frames.append(payload)
+
+        log = self._open_log()
+        log.write(b"".join(frames))
+        log.flush()
+        if self.sync:
+            os.fsync(log.fileno())
+
+    def rotate(self):
+        """
+        Starts a new log segment. Must be called while no records can be appended, and the state
+        captured at the same moment is what gets passed to `commit_snapshot`.
+
+        Returns:
+            int: The sequence number of the last record covered by the captured state.
+        """
+        self.close()
+        if os.path.exists(self.log_path):
+            if os.path.exists(self.old_log_path):
+                # A previous compaction never finished, keep its records along with the new ones
+                with open(self.old_log_path, "ab") as old, open(self.log_path, "rb") as f:
+                    shutil.copyfileobj(f, old)
+                os.remove(self.log_path)
+            else:
+                os.replace(self.log_path, self.old_log_path)
+        return self.seq
+
+    def commit_snapshot(self, state: dict, seq: int):
+        """
+        Writes `state` as the new snapshot and drops the log segment it replaces.
+
+        Args:
+            state (dict): The state captured when `rotate` was called.
+            seq (int): The sequence number returned by `rotate`.
+        """
+        write_snapshot(self.snapshot_path, dict(state, seq=seq))
+        if os.path.exists(self.old_log_path):
+            os.remove(self.old_log_path)
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _open_log(self):
+        if self._log is None:
+            self._log = open(self.log_path, "ab")
+        return self._log
+
+    def _read_log(self, path: str):
+        if not os.path.exists(path):
+            return
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        offset = 0
+        while offset + FRAME_HEADER.size <= len(data):
+            length, crc = FRAME_HEADER.unpack_from(data, offset)
+            start = offset + FRAME_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break  # Torn write from a crash, everything after it is garbage
+            yield pickle.loads(payload)
+            offset = start + length
+
+        if offset < len(data):
+            # Drop the torn tail so new records are not appended after garbage
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+
+def read_snapshot(path: str):
+    """
+    Unpickles the snapshot at `path`.
+
+    Returns:
+        dict: The snapshot, or an empty dictionary if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def write_snapshot(path: str, state: dict):
+    """
+    Pickles `state` to a temporary file and atomically renames it over `path`.
+
+    Args:
+        path (str): The snapshot path.
+        state (dict): The state to pickle.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
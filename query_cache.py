@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Size-limited LRU of tool results, tied to a store generation.
+
+    Every change to the store calls `invalidate`, which moves the generation on and drops every
+    entry, so a result is only ever served for the exact state it was computed from. Results
+    computed against an older generation are not stored at all.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> result, least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns:
+            The cached result for `key`, or None on a miss.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, result, generation: int):
+        """
+        Stores a result computed at `generation`, unless the store has changed since.
+        """
+        with self._lock:
+            if generation != self.generation or self.max_entries <= 0:
+                return
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,120 +1,238 @@
-import speech_recognition as sr
-import pyaudio
-import wave
-import os
+"""
+Records a spoken memory and turns it into a write_memory prompt on the clipboard.
+
+Audio is captured at 16 kHz into a preallocated ring buffer. An energy-based voice activity
+detector cuts it into segments at pauses, and each segment is transcribed by a local recognizer
+while recording continues, so the transcript is ready moments after you stop talking.
+"""
+import json
+import queue
 import threading
-import sys
+
+import numpy as np
+import pyaudio
 import pyperclip
 
-# Recording parameters
-CHUNK = 1024
+# Recording parameters. 16 kHz mono is what speech recognizers expect, so nothing is resampled.
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
-RATE = 44100
-WAVE_OUTPUT_FILENAME = "output.wav"
-
-# Flag to control recording
-is_recording = True
-frames = []
-
-def record_audio(stream, p):
-    """Records audio chunks into the global frames list."""
-    global frames, is_recording
+RATE = 16000
+FRAME_MS = 30
+CHUNK = RATE * FRAME_MS // 1000  # Samples per frame, also the unit the voice activity detector works in
+RING_SECONDS = 60  # Audio kept in the ring buffer, must be longer than MAX_SEGMENT_SECONDS
+
+# Voice activity detection
+ENERGY_THRESHOLD = 300  # Minimum RMS of a speech frame, in int16 units
+NOISE_RATIO = 3.0  # Speech must also be this many times louder than the running noise floor
+SPEECH_START_MS = 90  # Speech needed before a segment opens
+SILENCE_MS = 600  # Silence that closes a segment
+PRE_ROLL_MS = 300  # Audio kept from before speech was detected, so first syllables are not clipped
+MAX_SEGMENT_SECONDS = 20  # Longer segments are cut so their transcription starts during the speech
+
+# "vosk" and "faster-whisper" run locally, "google" sends segments to Google's web service
+RECOGNIZER = "vosk"
+VOSK_MODEL_PATH = "vosk-model-small-en-us-0.15"
+WHISPER_MODEL = "base.en"
+
+
+class RingBuffer:
+    """
+    Fixed-size int16 sample buffer addressed by absolute sample position.
+
+    Writes never allocate. Reads return a copy of any range that has not been overwritten yet.
+    """
+
+    def __init__(self, capacity: int):
+        self.samples = np.zeros(capacity, dtype=np.int16)
+        self.written = 0  # Samples written since the start, the position of the next sample
+
+    def write(self, samples):
+        capacity = len(self.samples)
+        samples = samples[-capacity:]
+        start = self.written % capacity
+        first = min(len(samples), capacity - start)
+        self.samples[start:start + first] = samples[:first]
+        self.samples[:len(samples) - first] = samples[first:]
+        self.written += len(samples)
+
+    def read(self, start: int, end: int):
+        capacity = len(self.samples)
+        start = max(start, self.written - capacity, 0)
+        indices = np.arange(start, end) % capacity
+        return self.samples[indices]
+
+
+class VoiceActivityDetector:
+    """
+    Cuts a stream of frames into speech segments by frame energy.
+
+    The noise floor follows the quiet frames, so the detector adapts to the room. `push` returns
+    the (start, end) sample positions of a segment once it is closed by silence or by length.
+    """
+
+    def __init__(self):
+        self.noise_floor = ENERGY_THRESHOLD / NOISE_RATIO
+        self.speech_frames = 0
+        self.silent_frames = 0
+        self.segment_start = None
+        self.segment_end = 0  # End of the last segment, the next one never reaches back past it
+        self.position = 0  # Sample position of the next frame
+
+    def push(self, frame):
+        start = self.position
+        self.position += len(frame)
+        rms = float(np.sqrt(np.mean(frame.astype(np.float32) ** 2)))
+        speech = rms > max(ENERGY_THRESHOLD, self.noise_floor * NOISE_RATIO)
+        if not speech:
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+
+        if self.segment_start is None:
+            self.speech_frames = self.speech_frames + 1 if speech else 0
+            if self.speech_frames * FRAME_MS >= SPEECH_START_MS:
+                speech_start = start - (self.speech_frames - 1) * len(frame)
+                self.segment_start = max(speech_start - RATE * PRE_ROLL_MS // 1000, self.segment_end)
+                self.silent_frames = 0
+            return None
+
+        self.silent_frames = 0 if speech else self.silent_frames + 1
+        if self.silent_frames * FRAME_MS >= SILENCE_MS or self.position - self.segment_start >= RATE * MAX_SEGMENT_SECONDS:
+            return self.close()
+        return None
+
+    def close(self):
+        """
+        Closes the open segment, if any, and returns its (start, end) sample positions.
+        """
+        if self.segment_start is None:
+            return None
+        segment = (self.segment_start, self.position)
+        self.segment_start = None
+        self.segment_end = self.position
+        self.speech_frames = 0
+        return segment
+
+
+def make_recognizer(name: str):
+    """
+    Returns a function that transcribes int16 PCM bytes at RATE. The engines are imported here so
+    only the chosen one has to be installed.
+    """
+    if name == "vosk":
+        from vosk import KaldiRecognizer, Model
+        model = Model(VOSK_MODEL_PATH)
+
+        def recognize(pcm: bytes):
+            recognizer = KaldiRecognizer(model, RATE)
+            recognizer.AcceptWaveform(pcm)
+            return json.loads(recognizer.FinalResult())["text"]
+        return recognize
+
+    if name == "faster-whisper":
+        from faster_whisper import WhisperModel
+        model = WhisperModel(WHISPER_MODEL, device="cpu", compute_type="int8")
+
+        def recognize(pcm: bytes):
+            audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768
+            segments, _ = model.transcribe(audio, beam_size=1)
+            return " ".join(segment.text.strip() for segment in segments)
+        return recognize
+
+    if name == "google":
+        import speech_recognition as sr
+        recognizer = sr.Recognizer()
+
+        def recognize(pcm: bytes):
+            try:
+                return recognizer.recognize_google(sr.AudioData(pcm, RATE, 2))
+            except sr.UnknownValueError:
+                return ""
+        return recognize
+
+    raise ValueError(f"Unknown recognizer {name!r}")
+
+
+def record_audio(stream, ring: RingBuffer, segments: queue.Queue, stop: threading.Event):
+    """Reads frames into the ring buffer and queues every closed speech segment for transcription."""
+    vad = VoiceActivityDetector()
     print("Recording... Press Enter to stop.")
-    while is_recording:
+    while not stop.is_set():
         try:
             data = stream.read(CHUNK, exception_on_overflow=False) # Add exception handling for overflow
-            frames.append(data)
         except IOError as e:
             # Handle potential input overflow or other stream errors
             print(f"Stream read error: {e}")
-            # Optionally decide if this error should stop recording
-            # is_recording = False
+            continue
+        frame = np.frombuffer(data, dtype=np.int16)
+        ring.write(frame)
+        segment = vad.push(frame)
+        if segment is not None:
+            segments.put(ring.read(*segment).tobytes())
+
+    # Whatever was being said when Enter was pressed is the last segment
+    segment = vad.close()
+    if segment is not None:
+        segments.put(ring.read(*segment).tobytes())
+    segments.put(None)
     print("Finished recording.")
 
-# Initialize PyAudio
-p = pyaudio.PyAudio()
-
-stream = p.open(format=FORMAT,
-                channels=CHANNELS,
-                rate=RATE,
-                input=True,
-                frames_per_buffer=CHUNK)
-
-# Start recording in a separate thread
-record_thread = threading.Thread(target=record_audio, args=(stream, p))
-record_thread.start()
-
-# Wait for user to press Enter in the main thread
-input("Press Enter to stop recording...\n")
-is_recording = False # Signal the recording thread to stop
-
-# Wait for the recording thread to finish
-record_thread.join()
-
-# Stop and close the stream
-stream.stop_stream()
-stream.close()
-p.terminate()
-
-# Save the recorded data as a WAV file
-if not frames:
-    print("No audio recorded.")
-    sys.exit() # Exit if no frames were captured
-
-wf = wave.open(WAVE_OUTPUT_FILENAME, 'wb')
-wf.setnchannels(CHANNELS)
-# Use get_sample_size from the PyAudio instance 'p' that was used to open the stream
-wf.setsampwidth(p.get_sample_size(FORMAT))
-wf.setframerate(RATE)
-wf.writeframes(b''.join(frames))
-wf.close()
-
-print(f"Saved recording as {WAVE_OUTPUT_FILENAME}")
-
-# Initialize the recognizer
-r = sr.Recognizer()
-
-# Process the saved audio file for speech-to-text
-audio_file_to_process = WAVE_OUTPUT_FILENAME # Directly use the WAV file
-
-if not os.path.exists(audio_file_to_process):
-    print(f"Error: Audio file {audio_file_to_process} not found for processing.")
-    sys.exit()
-
-try:
-    # use the audio file as the audio source
-    with sr.AudioFile(audio_file_to_process) as source:
-        print(f"Processing {audio_file_to_process} for speech-to-text...")
-        # reads the audio file.
-        audio_data = r.record(source) # Reads the entire file
-
-        # Using google to recognize audio
-        print("Sending audio to Google Speech Recognition...")
-        my_text = r.recognize_google(audio_data)
-        my_text = my_text.lower()
-
-        claude_prompt = f"Write the Following Memory w/ Punctuation & Typo Adjustments. Try to use existing memories to guess the names of the people in the memory. Make sure you review any name guesses with me before writing the memory and feel free to ask me about any people that you would want a name for. Memory: {my_text}"
-        pyperclip.copy(claude_prompt) # Copy the prompt to clipboard
-        print(claude_prompt) # Print the prompt for user reference
-
-except sr.RequestError as e:
-    print(f"Could not request results from Google Speech Recognition service; {e}")
-
-except sr.UnknownValueError:
-    print("Google Speech Recognition could not understand audio")
-
-except FileNotFoundError:
-    print(f"Error: Audio file not found at {audio_file_to_process}")
-
-except Exception as e: # Catch other potential exceptions during recognition
-    print(f"An unexpected error occurred during speech recognition: {e}")
 
-finally:
-    # Clean up the audio file
-    if os.path.exists(audio_file_to_process):
+def transcribe_segments(recognize, segments: queue.Queue, transcript: list):
+    """Transcribes segments as they arrive, until the recorder sends None."""
+    while (pcm := segments.get()) is not None:
         try:
-            os.remove(audio_file_to_process)
-            print(f"Removed temporary file {audio_file_to_process}")
-        except Exception as e:
-            print(f"Could not remove temporary file {audio_file_to_process}: {e}")
+            text = recognize(pcm).strip()
+        except Exception as e: # One failed segment should not lose the rest of the memory
+            print(f"Speech recognition failed for a segment: {e}")
+            continue
+        if text:
+            transcript.append(text)
+            print(f"... {text}")
+
+
+def main():
+    # Load the recognizer before recording, so the first segment does not wait for it
+    recognize = make_recognizer(RECOGNIZER)
+
+    # Initialize PyAudio
+    p = pyaudio.PyAudio()
+    stream = p.open(format=FORMAT,
+                    channels=CHANNELS,
+                    rate=RATE,
+                    input=True,
+                    frames_per_buffer=CHUNK)
+
+    ring = RingBuffer(RATE * RING_SECONDS)
+    segments = queue.Queue()
+    transcript = []
+    stop = threading.Event()
+
+    # Record and transcribe in separate threads
+    record_thread = threading.Thread(target=record_audio, args=(stream, ring, segments, stop))
+    transcribe_thread = threading.Thread(target=transcribe_segments, args=(recognize, segments, transcript))
+    record_thread.start()
+    transcribe_thread.start()
+
+    # Wait for user to press Enter in the main thread
+    input("Press Enter to stop recording...\n")
+    stop.set() # Signal the recording thread to stop
+
+    record_thread.join()
+    stream.stop_stream()
+    stream.close()
+    p.terminate()
+
+    # Only the segment that was open when recording stopped can still be in flight
+    transcribe_thread.join()
+
+    if not transcript:
+        print("No speech recognized.")
+        return
+
+    my_text = " ".join(transcript).lower()
+    claude_prompt = f"Write the Following Memory w/ Punctuation & Typo Adjustments. Try to use existing memories to guess the names of the people in the memory. Make sure you review any name guesses with me before writing the memory and feel free to ask me about any people that you would want a name for. Memory: {my_text}"
+    pyperclip.copy(claude_prompt) # Copy the prompt to clipboard
+    print(claude_prompt) # Print the prompt for user reference
+
+
+if __name__ == "__main__":
+    main()
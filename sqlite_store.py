@@ -0,0 +1,364 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from models import Memory, Topic
+
+logger = logging.getLogger("pensieve")
+
+# A reader that has not checkpointed for this long is taken for crashed, and no longer holds back pruning
+READER_TIMEOUT = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    time REAL NOT NULL,
+    insert_time REAL NOT NULL,
+    text TEXT NOT NULL,
+    topics TEXT NOT NULL,  -- JSON list of the topic names as written
+    title_embedding BLOB  -- NULL until the memory is embedded
+);
+CREATE INDEX IF NOT EXISTS memories_by_time ON memories (time, id);
+CREATE INDEX IF NOT EXISTS memories_by_insert_time ON memories (insert_time);
+
+-- One row per memory and lowercase topic key, ordered so a topic's timeline is a range scan
+CREATE TABLE IF NOT EXISTS memory_topics (
+    topic TEXT NOT NULL,
+    time REAL NOT NULL,
+    memory_id INTEGER NOT NULL,
+    PRIMARY KEY (topic, time, memory_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS memory_topics_by_memory ON memory_topics (memory_id);
+
+CREATE TABLE IF NOT EXISTS topics (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    embedding BLOB
+);
+
+CREATE TABLE IF NOT EXISTS chunks (
+    memory_id INTEGER NOT NULL,
+    chunk INTEGER NOT NULL,
+    embedding BLOB NOT NULL,
+    PRIMARY KEY (memory_id, chunk)
+) WITHOUT ROWID;
+
+-- Every committed record, so other processes on the same file can catch up on what they missed
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    operation TEXT NOT NULL,
+    key
+);
+
+-- Every process reading the changes and the last one it has applied, refreshed by each commit and
+-- checkpoint. Changes every reader is past are pruned
+CREATE TABLE IF NOT EXISTS readers (
+    id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    seen REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters (name, value) VALUES ('next_memory_id', 1);
+"""
+
+
+class SQLiteStore:
+    """
+    Keeps the Pensieve in a SQLite database instead of the snapshot and journal files.
+
+    The database runs in WAL mode, so any number of processes can read it while one writes.
+    Every commit also appends to a `changes` table. A process replays the changes it has not
+    seen yet, through `changes`, before reading, and before each of its own writes. That is how
+    several servers on the same file keep their in-memory indexes in step. Each process is
+    registered as a reader, and `checkpoint` deletes the changes that every reader has applied.
+
+    Statements are written as fixed strings, with lists passed as one JSON parameter, so
+    sqlite3's statement cache compiles each of them once per connection.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.seq = 0  # Last change this process has applied
+        self.reader_id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, cached_statements=256)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints, WAL keeps it consistent in between
+        self._db.execute("PRAGMA busy_timeout=10000")
+        self._db.executescript(SCHEMA)
+
+    def load(self):
+        """
+        Reads the whole store, for building the in-memory indexes at startup.
+
+        Returns:
+            dict: "memories" and "topics" like the snapshot has them, and "memory_embeddings",
+                "chunk_embeddings" and "topic_embeddings" as (keys, rows) pairs.
+        """
+        # Registering in the same transaction keeps the changes after self.seq from being pruned in between
+        with self._lock, self._transaction():
+            self.seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'changes'").fetchone()[0]
+            self._register()
+            memories = {}
+            memory_embeddings = ([], [])
+            for row in self._db.execute("SELECT id, title, time, insert_time, text, topics, title_embedding FROM memories"):
+                memories[row[0]] = memory_from_row(row)
+                if row[6] is not None:
+                    memory_embeddings[0].append(row[0])
+                    memory_embeddings[1].append(from_blob(row[6]))
+
+            topics = {}
+            topic_embeddings = ([], [])
+            for key, name, embedding in self._db.execute("SELECT key, name, embedding FROM topics"):
+                topics[key] = Topic(name)
+                if embedding is not None:
+                    topic_embeddings[0].append(key)
+                    topic_embeddings[1].append(from_blob(embedding))
+            for topic, time, memory_id in self._db.execute("SELECT topic, time, memory_id FROM memory_topics ORDER BY topic, time, memory_id"):
+                if topic not in topics:
+                    # Written by an older version that could lose the topic row to a concurrent delete
+                    topics[topic] = Topic(next(name for name in memories[memory_id].topics if name.lower() == topic))
+                topics[topic].memories.add(memory_id)
+                topics[topic].timeline.append((time, memory_id))
+
+            chunk_embeddings = ([], [])
+            for memory_id, chunk, embedding in self._db.execute("SELECT memory_id, chunk, embedding FROM chunks"):
+                chunk_embeddings[0].append((memory_id, chunk))
+                chunk_embeddings[1].append(from_blob(embedding))
+
+        return {
+            "memories": memories,
+            "topics": topics,
+            "memory_embeddings": memory_embeddings,
+            "chunk_embeddings": chunk_embeddings,
+            "topic_embeddings": topic_embeddings,
+        }
+
+    def allocate_ids(self, count: int):
+        """
+        Reserves `count` consecutive memory ids, unique across every process using the file.
+
+        Returns:
+            int: The first reserved id.
+        """
+        with self._lock, self._transaction():
+            next_id = self._db.execute(
+                "UPDATE counters SET value = value + ? WHERE name = 'next_memory_id' RETURNING value", (count,)
+            ).fetchone()[0]
+        return next_id - count
+
+    def changes(self):
+        """
+        Reads what other processes committed since this one last looked.
+
+        Returns:
+            list: Records to apply, in the same form as the journal's.
+        """
+        with self._lock, self._transaction("BEGIN"):
+            return self._read_changes()
+
+    def commit(self, records):
+        """
+        Writes records in one transaction.
+
+        Returns:
+            list: The records other processes committed before this write, which have to be
+                applied first, as from `changes`.
+        """
+        with self._lock, self._transaction():
+            missed = self._read_changes()
+            for record in records:
+                self._write(record)
+                self.seq = self._db.execute("INSERT INTO changes (operation, key) VALUES (?, ?)", (record[0], record_key(record))).lastrowid
+            self._register()
+        return missed
+
+    def memory_ids_by_time(self, start: float, end: float, topic_keys: list = None, limit: int = -1, offset: int = 0):
+        """
+        The ids of the memories between `start` and `end`, oldest first, optionally only those in the given topics.
+        """
+        if topic_keys is None:
+            rows = self._query(
+                "SELECT id FROM memories WHERE time BETWEEN ? AND ? ORDER BY time, id LIMIT ? OFFSET ?",
+                (start, end, limit, offset),
+            )
+        else:
+            rows = self._query(
+                "SELECT memory_id FROM memory_topics WHERE topic IN (SELECT value FROM json_each(?)) AND time BETWEEN ? AND ? "
+                "GROUP BY memory_id ORDER BY MIN(time), memory_id LIMIT ? OFFSET ?",
+                (json.dumps(topic_keys), start, end, limit, offset),
+            )
+        return [row[0] for row in rows]
+
+    def checkpoint(self):
+        """
+        Deletes the changes every live reader has applied, then folds the WAL back into the
+        database file. Also keeps this process registered, so call it periodically.
+        """
+        with self._lock:
+            with self._transaction():
+                self._register()
+                self._db.execute("DELETE FROM readers WHERE seen < ?", (time.time() - READER_TIMEOUT,))
+                self._db.execute("DELETE FROM changes WHERE seq <= (SELECT MIN(seq) FROM readers)")
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self._lock:
+            with self._transaction():
+                self._db.execute("DELETE FROM readers WHERE id = ?", (self.reader_id,))
+            self._db.close()
+
+    def _query(self, sql: str, parameters: tuple):
+        with self._lock:
+            return self._db.execute(sql, parameters).fetchall()
+
+    def _transaction(self, begin: str = "BEGIN IMMEDIATE"):
+        # Writers take the write lock up front, so reading the missed changes and writing happen atomically
+        return _Transaction(self._db, begin)
+
+    def _register(self):
+        self._db.execute("INSERT OR REPLACE INTO readers (id, seq, seen) VALUES (?, ?, ?)", (self.reader_id, self.seq, time.time()))
+
+    def _write(self, record):
+        operation, *args = record
+        db = self._db
+        if operation == "write":
+            memory, new_topics = args
+            db.execute(
+                "INSERT INTO memories (id, title, time, insert_time, text, topics, title_embedding) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (memory.id, memory.title, memory.time, memory.insert_time, memory.text, json.dumps(list(memory.topics)),
+                 to_blob(memory.title_embedding)),
+            )
+            # Every topic the memory uses gets a row, not only the ones that looked new when the write
+            # was prepared, since another process may have pruned one of those since
+            topic_rows = {}
+            for name in memory.topics:
+                key = name.lower()
+                if key not in topic_rows:
+                    topic = new_topics.get(key) or Topic(name)
+                    topic_rows[key] = (key, topic.name, to_blob(topic.embedding))
+            db.executemany("INSERT OR IGNORE INTO topics (key, name, embedding) VALUES (?, ?, ?)", list(topic_rows.values()))
+            db.executemany(
+                "INSERT OR IGNORE INTO memory_topics (topic, time, memory_id) VALUES (?, ?, ?)",
+                [(key, memory.time, memory.id) for key in topic_rows],
+            )
+            if memory.chunk_embeddings is not None:
+                self._write_chunks(memory.id, memory.chunk_embeddings)
+        elif operation == "embed_memory":
+            memory_id, title_embedding, chunk_embeddings = args
+            if db.execute("UPDATE memories SET title_embedding = ? WHERE id = ?", (to_blob(title_embedding), memory_id)).rowcount:
+                self._write_chunks(memory_id, chunk_embeddings)
+        elif operation == "embed_topic":
+            key, embedding = args
+            db.execute("UPDATE topics SET embedding = ? WHERE key = ?", (to_blob(embedding), key))
+        elif operation == "delete":
+            memory_id, = args
+            topic_keys = [row[0] for row in db.execute("SELECT topic FROM memory_topics WHERE memory_id = ?", (memory_id,))]
+            db.execute("DELETE FROM memories WHERE id = ?", (memory_id,))
+            db.execute("DELETE FROM memory_topics WHERE memory_id = ?", (memory_id,))
+            db.execute("DELETE FROM chunks WHERE memory_id = ?", (memory_id,))
+            # Topics are pruned as soon as they run empty, like in memory
+            db.execute(
+                "DELETE FROM topics WHERE key IN (SELECT value FROM json_each(?)) "
+                "AND NOT EXISTS (SELECT 1 FROM memory_topics WHERE topic = topics.key)",
+                (json.dumps(topic_keys),),
+            )
+        elif operation == "clear":
+            for table in ("memories", "memory_topics", "topics", "chunks"):
+                db.execute(f"DELETE FROM {table}")
+
+    def _write_chunks(self, memory_id: int, chunk_embeddings):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO chunks (memory_id, chunk, embedding) VALUES (?, ?, ?)",
+            [(memory_id, i, to_blob(embedding)) for i, embedding in enumerate(chunk_embeddings)],
+        )
+
+    def _read_changes(self):
+        db = self._db
+        records = []
+        rows = db.execute("SELECT seq, operation, key FROM changes WHERE seq > ? ORDER BY seq", (self.seq,)).fetchall()
+        if rows and rows[0][0] > self.seq + 1:
+            # Sequence numbers have no gaps, so changes were pruned while this process was taken for crashed
+            logger.warning("Changes %d to %d were pruned before this process applied them, restart it to reload the store", self.seq + 1, rows[0][0] - 1)
+        for seq, operation, key in rows:
+            self.seq = seq
+            # The rows hold the latest state, so a change to something deleted since is skipped
+            if operation == "write":
+                row = db.execute("SELECT id, title, time, insert_time, text, topics, title_embedding FROM memories WHERE id = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                memory = memory_from_row(row)
+                if row[6] is not None:
+                    memory.title_embedding = from_blob(row[6])
+                    memory.chunk_embeddings = self._read_chunks(key)
+                new_topics = {}
+                for topic_key, name, embedding in db.execute(
+                    "SELECT key, name, embedding FROM topics WHERE key IN (SELECT value FROM json_each(?))",
+                    (json.dumps(sorted({name.lower() for name in memory.topics})),),
+                ):
+                    new_topics[topic_key] = Topic(name, from_blob(embedding) if embedding is not None else None)
+                records.append(("write", memory, new_topics))
+            elif operation == "embed_memory":
+                row = db.execute("SELECT title_embedding FROM memories WHERE id = ?", (key,)).fetchone()
+                if row is not None and row[0] is not None:
+                    records.append(("embed_memory", key, from_blob(row[0]), self._read_chunks(key)))
+            elif operation == "embed_topic":
+                row = db.execute("SELECT embedding FROM topics WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[0] is not None:
+                    records.append(("embed_topic", key, from_blob(row[0])))
+            elif operation == "delete":
+                records.append(("delete", key))
+            elif operation == "clear":
+                records.append(("clear",))
+        return records
+
+    def _read_chunks(self, memory_id: int):
+        rows = self._db.execute("SELECT embedding FROM chunks WHERE memory_id = ? ORDER BY chunk", (memory_id,)).fetchall()
+        return [from_blob(row[0]) for row in rows]
+
+
+class _Transaction:
+    def __init__(self, db, begin: str):
+        self.db = db
+        self.begin = begin
+
+    def __enter__(self):
+        self.db.execute(self.begin)
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def record_key(record: tuple):
+    """
+    What a change row points at: the memory id, or the topic key for embed_topic.
+    """
+    operation = record[0]
+    if operation == "write":
+        return record[1].id
+    if operation in ("embed_memory", "embed_topic", "delete"):
+        return record[1]
+    return None
+
+
+def memory_from_row(row):
+    memory_id, title, time, insert_time, text, topics = row[:6]
+    return Memory(memory_id, title, time, text, json.loads(topics), insert_time)
+
+
+def to_blob(embedding):
+    return None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def from_blob(blob):
+    return np.frombuffer(blob, dtype=np.float32)
@@ -0,0 +1,224 @@
+import numpy as np
+
+from vector_store import MappedVectors, save_vectors
+
+
+def normalize(embeddings):
+    """
+    L2-normalizes a vector or the rows of a matrix so dot products become cosine similarities.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def top_k(scores, k: int):
+    """
+    Returns the indices of the k highest scores, best first, without sorting the whole array.
+    """
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class EmbeddingMatrix:
+    """
+    Exact cosine search over a contiguous, pre-normalized float32 matrix.
+
+    Rows are kept packed: a delete moves the last row into the freed slot, so inserts and
+    deletes are O(1) and a search is a single matrix-vector product plus a top-k selection.
+
+    The matrix can sit on top of a memory-mapped `base` written by `save`. The base is never
+    modified: writes go to the in-memory rows and deletes of base keys only mark the row dead.
+    Once a `frozen` copy is saved, `rebase` maps the new file as the base, so only the rows
+    changed since then stay in memory and the next copy is small.
+    """
+
+    def __init__(self, base: MappedVectors = None):
+        self.keys = []
+        self.rows = {}  # key -> row in the matrix
+        self._data = None  # Over-allocated buffer, only the first len(self.keys) rows are live
+        self.base = base
+        self._touched = None  # Keys written or removed since the last frozen copy, None when no copy is being saved
+
+    @classmethod
+    def open(cls, path: str):
+        """
+        Maps the vectors saved at `path` as the base of a new matrix.
+        """
+        return cls(MappedVectors(path))
+
+    def __len__(self):
+        return len(self.keys) + (self.base.live if self.base else 0)
+
+    def __contains__(self, key):
+        return key in self.rows or (self.base is not None and key in self.base)
+
+    @property
+    def matrix(self):
+        if self._data is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._data[:len(self.keys)]
+
+    def add(self, key, embedding):
+        """
+        Adds or replaces the embedding stored under `key`.
+        """
+        self.extend([key], [embedding])
+
+    def extend(self, keys, embeddings):
+        """
+        Adds many embeddings at once.
+
+        Args:
+            keys (list): The keys, one per embedding.
+            embeddings: A sequence of vectors or a 2D array with one row per key.
+        """
+        if not len(keys):
+            return
+        embeddings = normalize(np.vstack(embeddings))
+        if self._touched is not None:
+            self._touched.update(keys)
+        for key, embedding in zip(keys, embeddings):
+            if self.base is not None:
+                self.base.kill(key)
+            if key in self.rows:
+                self._data[self.rows[key]] = embedding
+                continue
+            self._reserve(len(self.keys) + 1, embedding.shape[0])
+            self._data[len(self.keys)] = embedding
+            self.rows[key] = len(self.keys)
+            self.keys.append(key)
+
+    def remove(self, key):
+        """
+        Removes the embedding stored under `key`, if any.
+        """
+        if self._touched is not None:
+            self._touched.add(key)
+        if self.base is not None:
+            self.base.kill(key)
+        row = self.rows.pop(key, None)
+        if row is None:
+            return
+        last = len(self.keys) - 1
+        if row != last:
+            last_key = self.keys[last]
+            self._data[row] = self._data[last]
+            self.keys[row] = last_key
+            self.rows[last_key] = row
+        self.keys.pop()
+
+    def clear(self):
+        self.keys = []
+        self.rows = {}
+        self._data = None
+        self.base = None
+        self._touched = None  # A copy taken before the clear must not become the base
+
+    def search(self, query_embedding, k: int):
+        """
+        Finds the k stored embeddings most similar to the query.
+
+        Args:
+            query_embedding: The query vector.
+            k (int): The number of results to return.
+        Returns:
+            list: (key, score) pairs, most similar first.
+        """
+        if not len(self):
+            return []
+        query_embedding = normalize(query_embedding)
+        scores = self.matrix @ query_embedding if self.keys else np.empty(0, dtype=np.float32)
+        if self.base is None:
+            return [(self.keys[i], float(scores[i])) for i in top_k(scores, k)]
+
+        # Base rows come first, then the in-memory rows
+        base_keys = self.base.keys
+        scores = np.concatenate([self.base.scores(query_embedding), scores])
+        best = top_k(scores, min(k, len(self)))
+        return [(base_keys[i] if i < len(base_keys) else self.keys[i - len(base_keys)], float(scores[i])) for i in best]
+
+    def score_keys(self, query_embedding, keys):
+        """
+        Scores only the given keys against the query, skipping keys that are not stored.
+
+        Returns:
+            list: (key, score) pairs, most similar first.
+        """
+        query_embedding = normalize(query_embedding)
+        scored = []
+        in_memory = [key for key in keys if key in self.rows]
+        if in_memory:
+            scores = self._data[[self.rows[key] for key in in_memory]] @ query_embedding
+            scored.extend(zip(in_memory, scores.tolist()))
+        if self.base is not None:
+            in_base = [key for key in keys if key not in self.rows and key in self.base]
+            if in_base:
+                base_rows = [self.base.row_of[key] for key in in_base]
+                scores = self.base.rows[base_rows].astype(np.float32) @ query_embedding
+                if self.base.scales is not None:
+                    scores *= self.base.scales[base_rows]
+                scored.extend(zip(in_base, scores.tolist()))
+        return sorted(scored, key=lambda item: item[1], reverse=True)
+
+    def blocks(self):
+        """
+        Yields (keys, normalized float32 rows) for every stored embedding, a block at a time.
+        """
+        if self.base is not None:
+            yield from self.base.blocks()
+        if self.keys:
+            yield list(self.keys), self.matrix
+
+    def frozen(self):
+        """
+        Returns a copy that can be saved while the original keeps changing. The mapped base is shared,
+        only the in-memory rows are copied.
+        """
+        copied = EmbeddingMatrix(self.base.copy() if self.base is not None else None)
+        if self.keys:
+            copied.keys = list(self.keys)
+            copied.rows = dict(self.rows)
+            copied._data = self.matrix.copy()
+        self._touched = set()
+        return copied
+
+    def rebase(self, base: MappedVectors):
+        """
+        Makes `base`, the file the last `frozen` copy was saved to, the new base. The in-memory rows it
+        holds are dropped, and the keys changed since the copy was taken keep their in-memory rows or
+        stay deleted. Does nothing if the matrix was cleared since.
+        """
+        if self._touched is None:
+            return
+        for key in self._touched:
+            base.kill(key)
+        kept = [key for key in self.keys if key in self._touched]
+        data = self._data[[self.rows[key] for key in kept]] if kept else None
+        self.keys = []
+        self.rows = {}
+        self._data = None
+        self.base = base
+        self._touched = None
+        if kept:
+            self.extend(kept, data)
+
+    def save(self, path: str, quantization: str = "float16"):
+        """
+        Writes every stored embedding to a file that `open` can map.
+        """
+        dim = self._data.shape[1] if self._data is not None else self.base.rows.shape[1] if self.base is not None else 0
+        save_vectors(path, self.blocks(), len(self), dim, quantization)
+
+    def _reserve(self, size: int, dim: int):
+        if self._data is None:
+            self._data = np.empty((max(size, 64), dim), dtype=np.float32)
+        elif size > len(self._data):
+            grown = np.empty((max(size, 2 * len(self._data)), dim), dtype=np.float32)
+            grown[:len(self.keys)] = self._data[:len(self.keys)]
+            self._data = grown
@@ -0,0 +1,113 @@
+import os
+import pickle
+
+import numpy as np
+
+from persistence import write_snapshot
+
+# How vectors are stored on disk. int8 keeps one float32 scale per row next to the quantized values.
+QUANTIZATIONS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+# Rows dequantized at a time while scoring or rewriting a mapped file
+BLOCK_ROWS = 8192
+
+
+class MappedVectors:
+    """
+    A read-only, memory-mapped set of normalized vectors written by `save_vectors`.
+
+    Only the keys and per-row scales are read into memory. The rows stay in the OS page cache,
+    where they are shared with any other process mapping the same file. Rows can be marked dead
+    when their key is deleted or overwritten, they are dropped the next time the file is rewritten.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path + ".meta", "rb") as f:
+            meta = pickle.load(f)
+        self.keys = meta["keys"]
+        self.scales = meta["scales"]
+        self.rows = np.load(path + ".npy", mmap_mode="r")
+        self.row_of = {key: row for row, key in enumerate(self.keys)}
+        self.alive = np.ones(len(self.keys), dtype=bool)
+        self.live = len(self.keys)
+
+    def __contains__(self, key):
+        row = self.row_of.get(key)
+        return row is not None and self.alive[row]
+
+    def kill(self, key):
+        row = self.row_of.get(key)
+        if row is not None and self.alive[row]:
+            self.alive[row] = False
+            self.live -= 1
+
+    def copy(self):
+        """
+        Returns a view of the same file with its own copy of the live-row mask.
+        """
+        copied = MappedVectors.__new__(MappedVectors)
+        copied.__dict__.update(self.__dict__)
+        copied.alive = self.alive.copy()
+        return copied
+
+    def scores(self, query):
+        """
+        Cosine similarity of every row to a normalized query, -inf for dead rows.
+        """
+        scores = np.empty(len(self.keys), dtype=np.float32)
+        for start in range(0, len(self.keys), BLOCK_ROWS):
+            block = self.rows[start:start + BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ query
+        if self.scales is not None:
+            scores *= self.scales
+        scores[~self.alive] = -np.inf
+        return scores
+
+    def blocks(self):
+        """
+        Yields (keys, float32 rows) for the live rows, a block at a time.
+        """
+        for start in range(0, len(self.keys), BLOCK_ROWS):
+            alive = self.alive[start:start + BLOCK_ROWS]
+            if not alive.any():
+                continue
+            block = self.rows[start:start + BLOCK_ROWS][alive].astype(np.float32)
+            if self.scales is not None:
+                block *= self.scales[start:start + BLOCK_ROWS][alive, None]
+            keys = self.keys[start:start + BLOCK_ROWS]
+            yield [key for key, live in zip(keys, alive) if live], block
+
+
+def save_vectors(path: str, blocks, count: int, dim: int, quantization: str = "float16"):
+    """
+    Writes vectors to `path`.npy with their keys and scales in `path`.meta, ready for `MappedVectors`.
+    Both files are written to temporary names and renamed into place.
+
+    Args:
+        path (str): The path without extension.
+        blocks: Yields (keys, float32 rows) pairs, `count` rows in total.
+        count (int): The total number of rows.
+        dim (int): The vector dimension.
+        quantization (str): One of QUANTIZATIONS.
+    """
+    dtype = QUANTIZATIONS[quantization]
+    keys = []
+    scales = np.empty(count, dtype=np.float32) if quantization == "int8" else None
+
+    tmp_path = path + ".tmp.npy"
+    rows = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(count, dim))
+    offset = 0
+    for block_keys, block in blocks:
+        end = offset + len(block_keys)
+        if scales is not None:
+            block_scales = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127
+            rows[offset:end] = np.round(block / block_scales[:, None])
+            scales[offset:end] = block_scales
+        else:
+            rows[offset:end] = block
+        keys.extend(block_keys)
+        offset = end
+    rows.flush()
+    del rows
+    os.replace(tmp_path, path + ".npy")
+    write_snapshot(path + ".meta", {"keys": keys, "scales": scales})